@@ -0,0 +1,179 @@
+"""
+Indexing throughput benchmark.
+
+Runs index_files_to_db against a synthetic channel served by FakeTelegram in
+place of LazyPrincessXBot.get_messages, and reports messages/sec, Mongo
+operations/sec and peak memory, so ingest changes can be compared without a
+Telegram account.
+
+It writes to a local mongod by default. DATABASE_URI, DATABASE_NAME and
+COLLECTION_NAME are honoured if set, so point them somewhere disposable:
+
+    python3 bench_index.py --messages 20000 --duplicates 0.3 --deleted 0.05
+"""
+import os
+
+os.environ.setdefault('DATABASE_URI', 'mongodb://localhost:27017')
+os.environ.setdefault('DATABASE_NAME', 'index_bench')
+os.environ.setdefault('COLLECTION_NAME', 'bench_files')
+
+import time
+import random
+import asyncio
+import argparse
+import resource
+from types import SimpleNamespace
+from collections import Counter
+from pymongo import monitoring
+from pyrogram import enums
+from pyrogram.file_id import FileId, FileType
+
+
+class CommandCounter(monitoring.CommandListener):
+    """Counts the commands every Mongo client sends, by command name."""
+
+    def __init__(self):
+        self.counts = Counter()
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self.counts[event.command_name] += 1
+
+    def failed(self, event):
+        self.counts[event.command_name] += 1
+
+
+# Must be registered before the database modules create their clients
+commands = CommandCounter()
+monitoring.register(commands)
+
+from database.ia_filterdb import Media, known_file_ids
+from database.index_jobs_db import mycol as index_jobs_col
+from lazybot.indexer import index_files_to_db
+
+MEDIA_TYPES = {
+    'video': (enums.MessageMediaType.VIDEO, FileType.VIDEO, 'video/mp4', 'mkv'),
+    'document': (enums.MessageMediaType.DOCUMENT, FileType.DOCUMENT, 'video/x-matroska', 'mkv'),
+    'audio': (enums.MessageMediaType.AUDIO, FileType.AUDIO, 'audio/mpeg', 'mp3'),
+}
+TITLES = ['Avengers Endgame', 'Kantara', 'Dark S01E02', 'Jailer', 'Leo', 'Interstellar', 'Vikram', 'RRR']
+QUALITIES = ['480p', '720p', '1080p', '2160p']
+
+
+class FakeMessage:
+    """Just enough of a Pyrogram message for the indexer and its progress reports."""
+
+    def __init__(self, msg_id, chat_id, kind=None, media=None, caption=None, empty=False):
+        self.id = msg_id
+        self.chat = SimpleNamespace(id=chat_id)
+        self.empty = empty
+        self.media = MEDIA_TYPES[kind][0] if kind in MEDIA_TYPES else None
+        self.caption = caption
+        if media is not None:
+            setattr(self, kind, media)
+
+    async def edit(self, *args, **kwargs):
+        pass
+
+    async def edit_text(self, *args, **kwargs):
+        pass
+
+
+class FakeTelegram:
+    """
+    Stands in for LazyPrincessXBot: serves a synthetic channel of `messages`
+    messages through get_messages, with `latency` seconds per call.
+    """
+
+    name = 'fake'
+
+    def __init__(self, chat_id, messages, mix, duplicates, deleted, latency, seed=0):
+        self.chat_id = chat_id
+        self.messages = messages
+        self.mix = mix
+        self.duplicates = duplicates
+        self.deleted = deleted
+        self.latency = latency
+        self.random = random.Random(seed)
+        self.next_media_id = 1
+        self.calls = 0
+
+    async def get_chat(self, chat):
+        return SimpleNamespace(id=self.chat_id)
+
+    async def get_messages(self, chat, ids):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return [self.make_message(msg_id) for msg_id in ids]
+
+    def make_message(self, msg_id):
+        if msg_id <= 0 or msg_id > self.messages or self.random.random() < self.deleted:
+            return FakeMessage(msg_id, self.chat_id, empty=True)
+        kind = self.random.choices(list(self.mix), weights=list(self.mix.values()))[0]
+        if kind not in MEDIA_TYPES:
+            return FakeMessage(msg_id, self.chat_id, kind=kind)
+        _, file_type, mime_type, extension = MEDIA_TYPES[kind]
+        if self.next_media_id > 1 and self.random.random() < self.duplicates:
+            media_id = self.random.randrange(1, self.next_media_id)
+        else:
+            media_id = self.next_media_id
+            self.next_media_id += 1
+        file_id = FileId(
+            file_type=file_type, dc_id=4, media_id=media_id, access_hash=media_id * 7919, file_reference=b''
+        ).encode()
+        title = f"{TITLES[media_id % len(TITLES)]} {QUALITIES[media_id % len(QUALITIES)]} {media_id}"
+        media = SimpleNamespace(
+            file_id=file_id,
+            file_name=f"{title.replace(' ', '.')}.{extension}",
+            file_size=self.random.randrange(10 ** 6, 4 * 10 ** 9),
+            mime_type=mime_type,
+        )
+        caption = SimpleNamespace(html=f"<b>{title}</b>") if self.random.random() < 0.5 else None
+        return FakeMessage(msg_id, self.chat_id, kind=kind, media=media, caption=caption)
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        kind, weight = part.split('=')
+        mix[kind.strip()] = float(weight)
+    return mix
+
+
+async def run(args):
+    chat_id = -1000000000000
+    if args.fresh:
+        await Media.collection.drop()
+    await index_jobs_col.delete_one({'_id': chat_id})
+    known_file_ids.reset()
+
+    bot = FakeTelegram(chat_id, args.messages, parse_mix(args.mix), args.duplicates, args.deleted, args.latency / 1000)
+    msg = FakeMessage(1, chat_id)
+    commands.counts.clear()
+    start = time.perf_counter()
+    await index_files_to_db(args.messages, chat_id, msg, bot)
+    elapsed = time.perf_counter() - start
+
+    ops = sum(commands.counts.values())
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"Messages:        {args.messages}")
+    print(f"Elapsed:         {elapsed:.2f}s")
+    print(f"Messages/sec:    {args.messages / elapsed:.0f}")
+    print(f"Fetch calls:     {bot.calls}")
+    print(f"Mongo ops:       {ops} ({ops / elapsed:.1f}/sec) {dict(commands.counts)}")
+    print(f"Peak RSS:        {peak:.1f} MB")
+    print(f"Stored files:    {await Media.count_documents()}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=10000, help='messages in the synthetic channel')
+    parser.add_argument('--mix', default='video=0.5,document=0.35,audio=0.05,text=0.1',
+                        help='weights of message kinds; kinds other than video/document/audio carry no media')
+    parser.add_argument('--duplicates', type=float, default=0.2, help='share of media reusing an earlier file')
+    parser.add_argument('--deleted', type=float, default=0.05, help='share of deleted (empty) messages')
+    parser.add_argument('--latency', type=float, default=150, help='milliseconds per get_messages call')
+    parser.add_argument('--fresh', action='store_true', help='drop the benchmark collection first')
+    asyncio.get_event_loop().run_until_complete(run(parser.parse_args()))
@@ -22,7 +22,7 @@ logging.getLogger("aiohttp.web").setLevel(logging.ERROR)
 
 from pyrogram import Client, __version__
 from pyrogram.raw.all import layer
-from database.ia_filterdb import Media
+from database.ia_filterdb import Media, ensure_indexes, check_indexes
 from database.users_chats_db import db
 from info import *
 from utils import temp
@@ -39,6 +39,9 @@ from pyrogram import idle
 from lazybot import LazyPrincessBot
 from util.keepalive import ping_server
 from lazybot.clients import initialize_clients
+from lazybot import multi_clients
+from util.media_sessions import media_sessions
+from lazybot.indexer import resume_index_jobs, sync_source_chats, live_ingest, remove_near_duplicates_periodically, move_cold_media_periodically
 
 
 ppath = "plugins/*.py"
@@ -69,7 +72,8 @@ async def Lazy_start():
     b_users, b_chats = await db.get_banned()
     temp.BANNED_USERS = b_users
     temp.BANNED_CHATS = b_chats
-    await Media.ensure_indexes()
+    await ensure_indexes()
+    await check_indexes()
     me = await LazyPrincessBot.get_me()
     temp.ME = me.id
     temp.U_NAME = me.username
@@ -86,7 +90,15 @@ async def Lazy_start():
     await app.setup()
     bind_address = "0.0.0.0"
     await web.TCPSite(app, bind_address, PORT).start()
+    asyncio.create_task(resume_index_jobs(LazyPrincessBot))
+    asyncio.create_task(sync_source_chats(LazyPrincessBot))
+    asyncio.create_task(remove_near_duplicates_periodically())
+    asyncio.create_task(move_cold_media_periodically())
+    if PREWARM_MEDIA_SESSIONS:
+        asyncio.create_task(media_sessions.prewarm(list(multi_clients.values())))
+    asyncio.create_task(media_sessions.health_check())
     await idle()
+    await live_ingest.close()
 
 
 if __name__ == '__main__':
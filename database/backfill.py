@@ -0,0 +1,162 @@
+"""
+Resumable backfill of Media fields.
+
+    python3 -m database.backfill metadata
+    python3 -m database.backfill compact --restart
+
+A reader walks the collection in _id order and hands batches to several
+workers, which compute each document's update with a function from BACKFILLS
+and apply a batch with one unordered bulk_write. Progress is checkpointed to
+the BACKFILLS collection as the _id up to which every batch is written, so a
+stopped run continues from there. Workers back off while writes are slow.
+"""
+import time
+import asyncio
+import logging
+import argparse
+import datetime
+from collections import deque
+from pymongo import UpdateOne, ASCENDING
+from database.ia_filterdb import Media, extract_metadata, compact_update
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Documents per batch, and batches written at the same time
+BACKFILL_BATCH_SIZE = 500
+BACKFILL_WORKERS = 4
+# A bulk_write slower than this many seconds makes its worker pause as long as it took
+SLOW_WRITE = 1.0
+# Seconds between two persisted checkpoints
+CHECKPOINT_INTERVAL = 10
+
+checkpoints = Media.collection.database['BACKFILLS']
+running = set()
+
+
+def metadata_update(doc):
+    """Set the resolution / languages / year / title_key fields that extract_metadata derives."""
+    metadata = extract_metadata(doc['file_name'], doc.get('caption'))
+    changed = {key: value for key, value in metadata.items() if value is not None and doc.get(key) != value}
+    return {'$set': changed} if changed else None
+
+
+# Backfill name -> function returning the update for a raw Media document, or None
+BACKFILLS = {
+    'metadata': metadata_update,
+    'compact': compact_update,
+}
+
+
+async def save_checkpoint(name, **data):
+    data['updated_at'] = datetime.datetime.utcnow()
+    await checkpoints.update_one({'_id': name}, {'$set': data}, upsert=True)
+
+
+async def run_backfill(name, restart=False, batch_size=BACKFILL_BATCH_SIZE, workers=BACKFILL_WORKERS):
+    """
+    Apply backfill `name` to every Media document, continuing an interrupted
+    run unless `restart`. Returns (scanned, updated, errors), or None if that
+    backfill is already running.
+    """
+    if name not in BACKFILLS:
+        raise ValueError(f"Unknown backfill '{name}', choose from {', '.join(BACKFILLS)}")
+    if name in running:
+        return None
+    running.add(name)
+    try:
+        return await backfill(name, restart, batch_size, workers)
+    finally:
+        running.discard(name)
+
+
+async def backfill(name, restart, batch_size, workers):
+    compute = BACKFILLS[name]
+    state = None if restart else await checkpoints.find_one({'_id': name, 'status': 'running'})
+    last_id = state['last_id'] if state else None
+    counts = {key: state.get(key, 0) if state else 0 for key in ('scanned', 'updated', 'errors')}
+    if state:
+        logger.info(f"Resuming backfill '{name}' after {last_id}")
+    # [last _id, written] per batch in _id order; the written prefix is the checkpoint
+    batches = deque()
+    checkpoint = {'last_id': last_id, 'at': time.monotonic()}
+    queue = asyncio.Queue(maxsize=workers * 2)
+
+    async def worker():
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            batch, docs = item
+            # A failing document or batch is counted and skipped; a dead worker would stall the reader
+            requests = []
+            for doc in docs:
+                try:
+                    update = compute(doc)
+                except Exception as e:
+                    logger.exception(f"Backfill '{name}' failed on {doc.get('_id')}: {e}")
+                    counts['errors'] += 1
+                    continue
+                if update:
+                    requests.append(UpdateOne({'_id': doc['_id']}, update))
+            if requests:
+                start = time.monotonic()
+                try:
+                    await Media.collection.bulk_write(requests, ordered=False)
+                    counts['updated'] += len(requests)
+                except Exception as e:
+                    logger.exception(f"Backfill '{name}' failed to write a batch: {e}")
+                    counts['errors'] += len(requests)
+                took = time.monotonic() - start
+                if took > SLOW_WRITE:
+                    await asyncio.sleep(took)
+            counts['scanned'] += len(docs)
+            batch[1] = True
+            while batches and batches[0][1]:
+                checkpoint['last_id'] = batches.popleft()[0]
+            if time.monotonic() - checkpoint['at'] >= CHECKPOINT_INTERVAL:
+                checkpoint['at'] = time.monotonic()
+                try:
+                    await save_checkpoint(name, status='running', last_id=checkpoint['last_id'], **counts)
+                except Exception as e:
+                    logger.warning(f"Could not save the checkpoint of backfill '{name}': {e}")
+
+    await save_checkpoint(name, status='running', last_id=last_id, **counts)
+    tasks = [asyncio.create_task(worker()) for _ in range(max(1, workers))]
+    try:
+        while True:
+            query = {'_id': {'$gt': last_id}} if last_id is not None else {}
+            docs = await Media.collection.find(query).sort('_id', ASCENDING).limit(batch_size).to_list(length=batch_size)
+            if not docs:
+                break
+            last_id = docs[-1]['_id']
+            batch = [last_id, False]
+            batches.append(batch)
+            await queue.put((batch, docs))
+        for _ in tasks:
+            await queue.put(None)
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await save_checkpoint(name, status='running', last_id=checkpoint['last_id'], **counts)
+        raise
+    await save_checkpoint(name, status='done', last_id=last_id, **counts)
+    logger.info(f"Backfill '{name}' done: {counts['updated']} of {counts['scanned']} files updated, {counts['errors']} errors")
+    return counts['scanned'], counts['updated'], counts['errors']
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('name', choices=list(BACKFILLS))
+    parser.add_argument('--restart', action='store_true', help='start over instead of continuing an interrupted run')
+    parser.add_argument('--batch-size', type=int, default=BACKFILL_BATCH_SIZE)
+    parser.add_argument('--workers', type=int, default=BACKFILL_WORKERS)
+    args = parser.parse_args()
+    start = time.time()
+    scanned, updated, errors = await run_backfill(args.name, args.restart, args.batch_size, args.workers)
+    print(f"Updated {updated} of {scanned} files in {time.time() - start:.1f}s, {errors} errors")
+
+
+if __name__ == '__main__':
+    asyncio.get_event_loop().run_until_complete(main())
@@ -1,13 +1,20 @@
 import logging
 import re
+import time
+import datetime
 import base64
+import asyncio
+import hashlib
+from array import array
 from struct import pack
+import numpy as np
 from pyrogram.file_id import FileId
-from pymongo.errors import DuplicateKeyError
+from pymongo import IndexModel, UpdateOne, ASCENDING, DESCENDING
+from pymongo.errors import DuplicateKeyError, BulkWriteError
 from umongo import Instance, Document, fields
 from motor.motor_asyncio import AsyncIOMotorClient
 from marshmallow.exceptions import ValidationError
-from info import DATABASE_URI, DATABASE_NAME, COLLECTION_NAME, USE_CAPTION_FILTER, MAX_B_TN
+from info import DATABASE_URI, DATABASE_NAME, COLLECTION_NAME, USE_CAPTION_FILTER, MAX_B_TN, LANGUAGES, COLD_TIER_DAYS, COLD_DATABASE_URI
 from utils import get_settings, save_group_settings
 
 logger = logging.getLogger(__name__)
@@ -18,66 +25,413 @@ client = AsyncIOMotorClient(DATABASE_URI)
 db = client[DATABASE_NAME]
 instance = Instance.from_db(db)
 
+# Cold tier: raw collection, optionally on its own cluster, holding files with
+# no search or delivery hit for COLD_TIER_DAYS (tiering is off when that is 0)
+cold_client = AsyncIOMotorClient(COLD_DATABASE_URI) if COLD_DATABASE_URI else client
+cold_media = cold_client[DATABASE_NAME][f'{COLLECTION_NAME}_cold']
+
 @instance.register
 class Media(Document):
     file_id = fields.StrField(attribute='_id', required=True)
+    # No longer written; declared so documents the 'compact' backfill hasn't reached still load
     file_ref = fields.StrField(allow_none=True)
     file_name = fields.StrField(required=True)
     file_size = fields.IntField(required=True)
     file_type = fields.StrField(allow_none=True)
     mime_type = fields.StrField(allow_none=True)
     caption = fields.StrField(allow_none=True)
+    resolution = fields.StrField(allow_none=True)
+    languages = fields.ListField(fields.StrField(), allow_none=True)
+    year = fields.IntField(allow_none=True)
+    title_key = fields.StrField(allow_none=True)
+    source_chat = fields.IntField(allow_none=True)
+    # Every source chat holding a copy, as the near-duplicate sweep keeps one document per release
+    source_chats = fields.ListField(fields.IntField(), allow_none=True)
+    # Search sort key: unlike $natural order, it can be walked through an index
+    indexed_at = fields.DateTimeField(allow_none=True)
+    last_hit = fields.DateTimeField(allow_none=True)
 
     class Meta:
         indexes = [('$file_name',), ('file_id',)]  # Added file_id index
         collection_name = COLLECTION_NAME
 
+# Number of queries answered by one aggregation in get_search_results_batch
+BATCH_SEARCH_SIZE = 25
+# Number of documents MediaBulkWriter sends per insert_many
+BULK_WRITE_SIZE = 500
+# Seconds before the known file_id snapshot is reloaded from the database
+KNOWN_IDS_MAX_AGE = 6 * 60 * 60
+# Recent additions kept in a set before they are merged into the sorted array
+KNOWN_IDS_MERGE_SIZE = 50000
+# Files moved per batch between the hot and cold tiers, and seconds between batches
+TIER_BATCH_SIZE = 1000
+TIER_PAUSE = 0.5
+# Duplicate file_ids deleted per delete_many by remove_near_duplicates, and example names reported
+DEDUP_DELETE_SIZE = 1000
+DEDUP_EXAMPLES = 10
+# Newest matches a grouped search collapses, so a keystroke never groups the whole collection
+GROUP_SCAN_LIMIT = 1000
+
+# Compound indexes for the filtered search shapes. `file_type` leads so that
+# `query | video` searches only walk the index keys of a single type, and the
+# indexed_at ones return a page of newest matches without a blocking sort.
+MEDIA_INDEXES = [
+    IndexModel([('file_type', ASCENDING), ('file_name', ASCENDING)], name='file_type_file_name'),
+    IndexModel([('indexed_at', DESCENDING)], name='indexed_at'),
+    IndexModel([('file_type', ASCENDING), ('indexed_at', DESCENDING)], name='file_type_indexed_at'),
+    IndexModel([('resolution', ASCENDING), ('file_name', ASCENDING)], name='resolution_file_name'),
+    IndexModel([('languages', ASCENDING), ('file_name', ASCENDING)], name='languages_file_name'),
+    IndexModel([('year', ASCENDING), ('file_name', ASCENDING)], name='year_file_name'),
+    IndexModel([('title_key', ASCENDING), ('resolution', ASCENDING)], name='title_key_resolution'),
+    IndexModel([('source_chat', ASCENDING), ('file_name', ASCENDING)], name='source_chat_file_name'),
+    IndexModel([('source_chats', ASCENDING), ('file_name', ASCENDING)], name='source_chats_file_name'),
+]
+if COLD_TIER_DAYS:
+    MEDIA_INDEXES.append(IndexModel([('last_hit', ASCENDING)], name='last_hit'))
+
+RESOLUTION_REGEX = re.compile(r'\b(\d{3,4})p\b|\b(4k|uhd)\b', flags=re.IGNORECASE)
+YEAR_REGEX = re.compile(r'\b(19\d{2}|20\d{2})\b')
+PAREN_YEAR_REGEX = re.compile(r'[(\[](19\d{2}|20\d{2})[)\]]')
+# Quality / source tags a release name puts after its title and year
+RELEASE_TAGS = (
+    r'\d{3,4}p|4k|uhd|hdrip|hdtv|web ?dl|web ?rip|bluray|brrip|bdrip|dvdrip|'
+    r'hdcam|camrip|predvd|x26[45]|h ?26[45]|hevc'
+)
+QUALITY_REGEX = re.compile(rf'\b({RELEASE_TAGS})\b', flags=re.IGNORECASE)
+LANGUAGE_NAMES = [language for language in LANGUAGES if language]
+HTML_TAG_REGEX = re.compile(r'<[^>]+>')
+# Everything from the first year / quality / source tag after the title is release noise
+TITLE_NOISE_REGEX = re.compile(rf'\b(19\d{{2}}|20\d{{2}}|{RELEASE_TAGS})\b', flags=re.IGNORECASE)
+# Channel handles and [group] tags in front of the title
+TITLE_PREFIX_REGEX = re.compile(r'^(\s*(@\S+|[\[({][^\])}]*[\])}]))+')
+# File extension, after a dot or after the space build_media turned it into
+EXTENSION_REGEX = re.compile(r'[\s.](mkv|mp4|avi|m4v|mov|wmv|webm|flv|3gp|mp3|m4a|flac|aac|ogg|zip|rar|7z|pdf|srt|apk)$')
+
 async def ensure_indexes():
     """Ensure indexes are created for efficient querying."""
     await Media.ensure_indexes()
+    try:
+        await Media.collection.create_indexes(MEDIA_INDEXES)
+        if COLD_TIER_DAYS:
+            await cold_media.create_index('file_name')
+            await cold_media.create_index([('indexed_at', DESCENDING)])
+    except Exception as e:
+        logger.exception(f"Error building search indexes: {e}")
+
+async def check_indexes():
+    """
+    Report declared indexes that are missing and existing indexes that were never used.
+    Returns (missing, unused) as lists of index names.
+    """
+    existing = await Media.collection.index_information()
+    declared = [index.document['name'] for index in MEDIA_INDEXES]
+    missing = [name for name in declared if name not in existing]
+    unused = []
+    try:
+        async for stat in Media.collection.aggregate([{'$indexStats': {}}]):
+            if stat['name'] != '_id_' and stat['accesses']['ops'] == 0:
+                unused.append(stat['name'])
+    except Exception as e:
+        # $indexStats needs clusterMonitor rights that some shared tiers don't grant
+        logger.warning(f"Could not read index usage stats: {e}")
+
+    if missing:
+        logger.warning(f"Missing search indexes: {', '.join(missing)}")
+    if unused:
+        logger.info(f"Indexes with no recorded use since server start: {', '.join(unused)}")
+    return missing, unused
+
+def normalize_title(file_name):
+    """
+    Reduce a file name to the title it was released under, so that uploads of
+    the same release by different groups share a key. Episode markers are kept.
+    """
+    title = EXTENSION_REGEX.sub('', file_name.lower().strip())
+    title = TITLE_PREFIX_REGEX.sub(' ', title).strip()
+    # Searching from 1 keeps titles that are a year-like number, e.g. "1917"
+    noise = TITLE_NOISE_REGEX.search(title, 1)
+    if noise:
+        title = title[:noise.start()]
+    title = re.sub(r'[\[({].*?[\])}]', ' ', title)
+    title = re.sub(r'[^a-z0-9]+', ' ', title).strip()
+    return title or file_name.lower().strip()
+
+def extract_year(text):
+    """
+    Return the release year of `text`: a parenthesised year if there is one,
+    else the last year-like number before the quality tags, so that titles
+    such as "1917" or "2012" aren't taken for the year.
+    """
+    match = PAREN_YEAR_REGEX.search(text)
+    if match:
+        return int(match.group(1))
+    quality = QUALITY_REGEX.search(text)
+    years = YEAR_REGEX.findall(text[:quality.start()] if quality else text)
+    return int(years[-1]) if years else None
+
+def extract_metadata(file_name, caption=None):
+    """Extract resolution, languages, year and title key from a file name (and caption)."""
+    text = f"{file_name} {caption or ''}"
+    match = RESOLUTION_REGEX.search(text)
+    if not match:
+        resolution = None
+    elif match.group(1):
+        resolution = f"{match.group(1)}p"
+    else:
+        resolution = "2160p"
+    lowered = text.lower()
+    languages = [language for language in LANGUAGE_NAMES if re.search(rf'\b{language}\b', lowered)]
+    return {
+        'resolution': resolution,
+        'languages': languages or None,
+        'year': extract_year(file_name) or (extract_year(caption) if caption else None),
+        'title_key': normalize_title(file_name),
+    }
+
+def build_media(media):
+    """
+    Build a validated Media document from a Pyrogram media object.
+    Raises ValidationError if the media can't be stored.
+    """
+    file_id, _ = unpack_new_file_id(media.file_id)
+    source_chat = getattr(media, 'source_chat', None)
+    caption = strip_caption(media.caption.html) if media.caption else None
+    # Videos and audios can come without a file name; name them after the caption
+    file_name = media.file_name or (caption.split('\n', 1)[0] if caption else None) or f"{getattr(media, 'file_type', None) or 'file'} {(file_id or '')[-8:]}"
+    file_name = re.sub(r"[_+.-]+", " ", file_name.strip())  # Simplified regex
+
+    data = dict(
+        file_type=media.file_type,
+        mime_type=media.mime_type,
+        caption=caption,
+        source_chat=source_chat,
+        source_chats=[source_chat] if source_chat is not None else None,
+        indexed_at=datetime.datetime.utcnow(),
+        **extract_metadata(file_name, caption),
+    )
+    # Unset fields are left out of the document rather than stored as null
+    file = Media(
+        file_id=file_id,
+        file_name=file_name,
+        file_size=media.file_size,
+        **{key: value for key, value in data.items() if value is not None}
+    )
+    file.required_validate()
+    return file
+
+def strip_caption(caption):
+    """Drop the markup of an HTML caption. Entities stay escaped, so it still sends as HTML."""
+    return HTML_TAG_REGEX.sub('', caption).strip() or None
+
+def compact_update(doc):
+    """
+    Return the update that brings raw Media document `doc` to the compact layout
+    (no file_ref, no null fields, caption without markup), or None if it's there.
+    """
+    unset = {key: '' for key, value in doc.items() if value is None or value == []}
+    if 'file_ref' in doc:
+        unset['file_ref'] = ''
+    update = {}
+    caption = doc.get('caption')
+    if caption:
+        stripped = strip_caption(caption)
+        if stripped is None:
+            unset['caption'] = ''
+        elif stripped != caption:
+            update['$set'] = {'caption': stripped}
+    if unset:
+        update['$unset'] = unset
+    return update or None
 
 async def save_file(media):
     """Save file in database and return (success, status_code)."""
-    file_id, file_ref = unpack_new_file_id(media.file_id)
-    file_name = re.sub(r"[_+.-]+", " ", media.file_name.strip())  # Simplified regex
+    file_name = media.file_name
 
     try:
-        file = Media(
-            file_id=file_id,
-            file_ref=file_ref,
-            file_name=file_name,
-            file_size=media.file_size,
-            file_type=media.file_type,
-            mime_type=media.mime_type,
-            caption=media.caption.html if media.caption else None,
-        )
+        file = build_media(media)
+        file_name = file.file_name
         await file.commit()
+        known_file_ids.add(file.file_id)
         logger.info(f"Saved '{file_name}' to database")
         return True, 1
     except ValidationError as e:
         logger.exception(f"Validation error while saving '{file_name}': {e}")
         return False, 2
     except DuplicateKeyError:
+        known_file_ids.add(file.file_id)
         logger.warning(f"'{file_name}' is already in database")
         return False, 0
     except Exception as e:
         logger.exception(f"Unexpected error saving '{file_name}': {e}")
         return False, -1
 
-async def get_search_results(chat_id, query, file_type=None, max_results=3, offset=0, filter=False):
+class KnownFileIds:
     """
-    Search for files matching query.
-    Returns (results, next_offset, total_results).
+    Compact in-memory membership set of the file_ids stored in Media, so that
+    re-indexing can skip known duplicates without a database call.
+    IDs are kept as sorted 64-bit hashes (8 bytes each, ~16MB for 2M files)
+    plus a small set of recent additions. The snapshot is loaded lazily and
+    reloaded once it is older than KNOWN_IDS_MAX_AGE. Deleted files are taken
+    out with discard(), so they can be indexed again; reset() drops the whole
+    snapshot after bulk deletes.
     """
-    if chat_id is not None:
-        settings = await get_settings(int(chat_id))
-        max_results = MAX_B_TN if not settings.get('max_btn', False) else 8
-        # Ensure settings are saved if missing
-        if 'max_btn' not in settings:
-            await save_group_settings(int(chat_id), 'max_btn', False)
-            settings = await get_settings(int(chat_id))
-            max_results = MAX_B_TN if not settings.get('max_btn', False) else 8
 
+    def __init__(self):
+        self.hashes = np.empty(0, dtype=np.uint64)
+        self.recent = set()
+        # Discarded while a load is scanning, removed from its snapshot afterwards
+        self.removed = set()
+        self.loaded_at = None
+        self.lock = asyncio.Lock()
+
+    @staticmethod
+    def hash(file_id):
+        return int.from_bytes(hashlib.blake2b(file_id.encode(), digest_size=8).digest(), 'little')
+
+    @property
+    def loaded(self):
+        return self.loaded_at is not None and time.monotonic() - self.loaded_at < KNOWN_IDS_MAX_AGE
+
+    async def load(self):
+        """Load the file_ids stored in Media (and its cold tier), unless a fresh snapshot is loaded already."""
+        async with self.lock:
+            if self.loaded:
+                return
+            self.removed.clear()
+            hashes = array('Q')
+            for collection in [Media.collection, cold_media] if COLD_TIER_DAYS else [Media.collection]:
+                async for doc in collection.find({}, {'_id': 1}, batch_size=10000):
+                    hashes.append(self.hash(doc['_id']))
+            hashes = np.sort(np.frombuffer(hashes, dtype=np.uint64))
+            if self.removed:
+                hashes = hashes[~np.isin(hashes, np.fromiter(self.removed, dtype=np.uint64, count=len(self.removed)))]
+                self.removed.clear()
+            self.hashes = hashes
+            self.loaded_at = time.monotonic()
+            logger.info(f"Loaded {len(self.hashes)} known file ids")
+
+    def reset(self):
+        self.hashes = np.empty(0, dtype=np.uint64)
+        self.recent.clear()
+        self.loaded_at = None
+
+    def add(self, file_id):
+        self.recent.add(self.hash(file_id))
+        if len(self.recent) >= KNOWN_IDS_MERGE_SIZE:
+            recent = np.fromiter(self.recent, dtype=np.uint64, count=len(self.recent))
+            self.hashes = np.union1d(self.hashes, recent)
+            self.recent.clear()
+
+    def discard(self, file_ids):
+        """Forget `file_ids` after they were deleted from the database."""
+        values = {self.hash(file_id) for file_id in file_ids}
+        if not values:
+            return
+        self.recent -= values
+        if self.lock.locked():
+            self.removed |= values
+        removed = np.fromiter(values, dtype=np.uint64, count=len(values))
+        self.hashes = self.hashes[~np.isin(self.hashes, removed)]
+
+    def __contains__(self, file_id):
+        value = self.hash(file_id)
+        if value in self.recent:
+            return True
+        value = np.uint64(value)
+        i = np.searchsorted(self.hashes, value)
+        return i < len(self.hashes) and self.hashes[i] == value
+
+
+known_file_ids = KnownFileIds()
+
+class MediaBulkWriter:
+    """
+    Buffers Media documents and stores them with unordered insert_many calls,
+    so bulk indexing pays one round trip per batch instead of one per file.
+    Duplicates are counted from the BulkWriteError details instead of raising.
+
+    attributes:
+        saved: documents inserted so far.
+        duplicate: documents skipped because their file_id is already stored.
+        errors: documents that failed validation or could not be written.
+        failed_tags: the tags given to add() of the files that could not be
+            written, e.g. their message; files that failed validation are
+            left out, as retrying them can't help.
+    """
+
+    def __init__(self, batch_size: int = BULK_WRITE_SIZE):
+        self.batch_size = batch_size
+        self.buffer = []
+        self.tags = []
+        self.saved = 0
+        self.duplicate = 0
+        self.errors = 0
+        self.failed_tags = []
+
+    async def add(self, media, tag=None):
+        """Validate and buffer `media`, flushing once a full batch is collected."""
+        if not known_file_ids.loaded:
+            await known_file_ids.load()
+        try:
+            file_id, _ = unpack_new_file_id(media.file_id)
+            if file_id and file_id in known_file_ids:
+                self.duplicate += 1
+                return
+            file = build_media(media)
+        except ValidationError as e:
+            logger.error(f"Validation error while saving '{media.file_name}': {e}")
+            self.errors += 1
+            return
+        except Exception as e:
+            # One unreadable file must not fail the whole index job
+            logger.exception(f"Error while saving '{getattr(media, 'file_name', None)}': {e}")
+            self.errors += 1
+            if tag is not None:
+                self.failed_tags.append(tag)
+            return
+        self.buffer.append(file.to_mongo())
+        self.tags.append(tag)
+        if len(self.buffer) >= self.batch_size:
+            await self.flush()
+
+    async def flush(self):
+        """Insert every buffered document."""
+        if not self.buffer:
+            return
+        docs, self.buffer = self.buffer, []
+        tags, self.tags = self.tags, []
+        # Positions of the documents that are neither stored nor duplicates
+        failed = set()
+        try:
+            result = await Media.collection.insert_many(docs, ordered=False)
+            saved, duplicate, errors = len(result.inserted_ids), 0, 0
+        except BulkWriteError as e:
+            write_errors = e.details.get('writeErrors', [])
+            saved = e.details.get('nInserted', 0)
+            failed = {error.get('index') for error in write_errors if error.get('code') != 11000}
+            duplicate = len(write_errors) - len(failed)
+            errors = len(failed)
+        except Exception as e:
+            logger.exception(f"Unexpected error saving {len(docs)} files: {e}")
+            saved, duplicate, errors = 0, 0, len(docs)
+            failed = set(range(len(docs)))
+        for i, doc in enumerate(docs):
+            if i not in failed:
+                known_file_ids.add(doc['_id'])
+            elif tags[i] is not None:
+                self.failed_tags.append(tags[i])
+        self.saved += saved
+        self.duplicate += duplicate
+        self.errors += errors
+        logger.info(f"Saved {saved} of {len(docs)} files to database ({duplicate} duplicates, {errors} errors)")
+
+def get_search_filter(query, file_type=None, resolution=None, language=None, year=None, sources=None):
+    """
+    Build the Mongo filter for a search query.
+    `resolution`, `language` and `year` refine it with indexed equality matches,
+    `sources` limits it to files indexed from the given chats.
+    Returns None if the query does not compile to a valid regex.
+    """
     query = query.strip()
     if not query:
         raw_pattern = '.'
@@ -88,7 +442,7 @@ async def get_search_results(chat_id, query, file_type=None, max_results=3, offs
         regex = re.compile(raw_pattern, flags=re.IGNORECASE)
     except re.error as e:
         logger.error(f"Invalid regex pattern '{raw_pattern}': {e}")
-        return [], '', 0
+        return None
 
     mongo_filter = (
         {'$or': [{'file_name': regex}, {'caption': regex}]} if USE_CAPTION_FILTER 
@@ -96,45 +450,361 @@ async def get_search_results(chat_id, query, file_type=None, max_results=3, offs
     )
     if file_type:
         mongo_filter['file_type'] = file_type
+    if resolution:
+        mongo_filter['resolution'] = resolution
+    if language:
+        mongo_filter['languages'] = language
+    if year:
+        mongo_filter['year'] = int(year)
+    if sources:
+        sources = [int(source) for source in sources]
+        # Files stored before source_chats existed only have their source_chat
+        mongo_filter['$and'] = [{'$or': [
+            {'source_chats': {'$in': sources}},
+            {'source_chats': {'$exists': False}, 'source_chat': {'$in': sources}},
+        ]}]
+    return mongo_filter
+
+async def get_max_results(chat_id, max_results):
+    """Return the page size configured for the chat, or `max_results` without one."""
+    if chat_id is None:
+        return max_results
+    settings = await get_settings(int(chat_id))
+    # Ensure settings are saved if missing
+    if 'max_btn' not in settings:
+        await save_group_settings(int(chat_id), 'max_btn', False)
+        settings = await get_settings(int(chat_id))
+    return MAX_B_TN if not settings.get('max_btn', False) else 8
+
+async def get_chat_sources(chat_id):
+    """Return the source chats a group's searches are limited to, or None for all."""
+    if chat_id is None:
+        return None
+    settings = await get_settings(int(chat_id))
+    return settings.get('sources') or None
+
+async def get_search_results(chat_id, query, file_type=None, max_results=3, offset=0, filter=False, **refine):
+    """
+    Search for files matching query.
+    `refine` takes the resolution / language / year / sources filters of get_search_filter;
+    sources default to the ones configured for the chat.
+    Returns (results, next_offset, total_results).
+    """
+    max_results = await get_max_results(chat_id, max_results)
+    refine.setdefault('sources', await get_chat_sources(chat_id))
+    mongo_filter = get_search_filter(query, file_type, **refine)
+    if mongo_filter is None:
+        return [], '', 0
 
     try:
         total_results = await Media.count_documents(mongo_filter)
         next_offset = offset + max_results if offset + max_results < total_results else ''
 
-        cursor = Media.find(mongo_filter).sort('$natural', -1).skip(offset).limit(max_results)
+        cursor = Media.find(mongo_filter).sort('indexed_at', DESCENDING).skip(offset).limit(max_results)
         files = await cursor.to_list(length=max_results)
+        if not total_results and COLD_TIER_DAYS:
+            files, total_results = await search_cold_media(mongo_filter, offset, max_results)
+            next_offset = offset + max_results if offset + max_results < total_results else ''
+        record_media_hits(file.file_id for file in files)
         return files, next_offset, total_results
     except Exception as e:
         logger.exception(f"Error in search: {e}")
         return [], '', 0
 
-async def get_bad_files(query, file_type=None, filter=False):
+async def get_faceted_search_results(chat_id, query, file_type=None, max_results=3, offset=0, **refine):
     """
-    Get all files matching query (no pagination).
-    Returns (results, total_results).
+    Search like get_search_results, and count the matched set by resolution,
+    language, file type and year. The counts come from the same aggregation
+    that produces the total, so a faceted search costs no extra round trip.
+    Returns (results, next_offset, total_results, facets) where facets maps
+    each facet name to a list of (value, count) pairs, largest first.
     """
-    query = query.strip()
-    if not query:
-        raw_pattern = '.'
-    else:
-        raw_pattern = r'\b' + re.escape(query) + r'\b' if ' ' not in query else query.replace(' ', r'.*[\s\.\+\-_]')
+    max_results = await get_max_results(chat_id, max_results)
+    refine.setdefault('sources', await get_chat_sources(chat_id))
+    mongo_filter = get_search_filter(query, file_type, **refine)
+    if mongo_filter is None:
+        return [], '', 0, {}
+
+    pipeline = [
+        {'$match': mongo_filter},
+        {'$facet': {
+            'total': [{'$count': 'total'}],
+            'resolution': [{'$sortByCount': '$resolution'}],
+            'language': [{'$unwind': '$languages'}, {'$sortByCount': '$languages'}],
+            'file_type': [{'$sortByCount': '$file_type'}],
+            'year': [{'$sortByCount': '$year'}],
+        }},
+    ]
+
+    async def search(collection):
+        cursor = collection.find(mongo_filter).sort('indexed_at', DESCENDING).skip(offset).limit(max_results)
+        docs, counts = await asyncio.gather(
+            cursor.to_list(length=max_results),
+            collection.aggregate(pipeline, allowDiskUse=True).to_list(length=1),
+        )
+        counts = counts[0] if counts else {}
+        total = counts.pop('total', None)
+        return [Media.build_from_mongo(doc) for doc in docs], total[0]['total'] if total else 0, counts
 
     try:
-        regex = re.compile(raw_pattern, flags=re.IGNORECASE)
-    except re.error as e:
-        logger.error(f"Invalid regex pattern '{raw_pattern}': {e}")
-        return [], 0
+        files, total_results, counts = await search(Media.collection)
+        if not total_results and COLD_TIER_DAYS:
+            files, total_results, counts = await search(cold_media)
+    except Exception as e:
+        logger.exception(f"Error in faceted search: {e}")
+        return [], '', 0, {}
 
-    mongo_filter = (
-        {'$or': [{'file_name': regex}, {'caption': regex}]} if USE_CAPTION_FILTER 
-        else {'file_name': regex}
-    )
-    if file_type:
-        mongo_filter['file_type'] = file_type
+    record_media_hits(file.file_id for file in files)
+    next_offset = offset + max_results if offset + max_results < total_results else ''
+    facets = {
+        name: [(bucket['_id'], bucket['count']) for bucket in buckets if bucket['_id'] is not None]
+        for name, buckets in counts.items()
+    }
+    return files, next_offset, total_results, facets
+
+async def get_grouped_search_results(chat_id, query, file_type=None, max_results=3, offset=0, **refine):
+    """
+    Search like get_search_results, but collapse uploads of the same release
+    (same title key and resolution) into one entry, so a page lists distinct titles.
+    Only the newest GROUP_SCAN_LIMIT matches are grouped, through the
+    indexed_at index, and groups come newest first.
+    Returns (groups, next_offset, total_groups). Each group is a dict with
+    its `key`, `title_key`, `resolution`, `count` and its newest upload as
+    `file`; get_group_variants() fetches the rest on demand.
+    """
+    max_results = await get_max_results(chat_id, max_results)
+    refine.setdefault('sources', await get_chat_sources(chat_id))
+    mongo_filter = get_search_filter(query, file_type, **refine)
+    if mongo_filter is None:
+        return [], '', 0
 
+    pipeline = [
+        {'$match': mongo_filter},
+        {'$sort': {'indexed_at': -1}},
+        {'$limit': GROUP_SCAN_LIMIT},
+        {'$group': {
+            # Documents without a title key yet stay ungrouped
+            '_id': {'title': {'$ifNull': ['$title_key', '$_id']}, 'resolution': '$resolution'},
+            'count': {'$sum': 1},
+            'file': {'$first': '$$ROOT'},
+            'latest': {'$first': '$indexed_at'},
+        }},
+        {'$sort': {'latest': -1, '_id': 1}},
+        {'$facet': {
+            'total': [{'$count': 'total'}],
+            'groups': [{'$skip': offset}, {'$limit': max_results}],
+        }},
+    ]
     try:
-        cursor = Media.find(mongo_filter).sort('$natural', -1)
+        result = await Media.collection.aggregate(pipeline, allowDiskUse=True).to_list(length=1)
+        if not (result and result[0].get('total')) and COLD_TIER_DAYS:
+            result = await cold_media.aggregate(pipeline, allowDiskUse=True).to_list(length=1)
+    except Exception as e:
+        logger.exception(f"Error in grouped search: {e}")
+        return [], '', 0
+
+    result = result[0] if result else {}
+    total = result.get('total')
+    total_groups = total[0]['total'] if total else 0
+    next_offset = offset + max_results if offset + max_results < total_groups else ''
+    groups = [
+        {
+            'key': group['_id'],
+            'title_key': group['file'].get('title_key'),
+            'resolution': group['_id'].get('resolution'),
+            'count': group['count'],
+            'file': Media.build_from_mongo(group['file']),
+        }
+        for group in result.get('groups', [])
+    ]
+    record_media_hits(group['file'].file_id for group in groups)
+    return groups, next_offset, total_groups
+
+async def get_group_variants(chat_id, query, key, file_type=None, max_results=50, **refine):
+    """
+    Get the uploads collapsed into the group with `key` by the grouped search
+    for `query`, with the same filters and source scope, largest first.
+    """
+    refine.setdefault('sources', await get_chat_sources(chat_id))
+    mongo_filter = get_search_filter(query, file_type, **refine)
+    if mongo_filter is None:
+        return []
+    mongo_filter = {'$and': [
+        mongo_filter,
+        # A group without a title key is a single ungrouped document
+        {'$or': [{'title_key': key['title']}, {'title_key': None, '_id': key['title']}]},
+        {'resolution': key.get('resolution')},
+    ]}
+    try:
+        docs = await Media.collection.find(mongo_filter).sort('file_size', -1).limit(max_results).to_list(length=max_results)
+        if not docs and COLD_TIER_DAYS:
+            docs = await cold_media.find(mongo_filter).sort('file_size', -1).limit(max_results).to_list(length=max_results)
+        files = [Media.build_from_mongo(doc) for doc in docs]
+        record_media_hits(file.file_id for file in files)
+        return files
+    except Exception as e:
+        logger.exception(f"Error fetching variants of '{key['title']}': {e}")
+        return []
+
+async def delete_media(query):
+    """
+    Delete the files matching `query` from Media and its cold tier, and forget
+    their file_ids. Returns the number deleted.
+    """
+    deleted = 0
+    for collection in [Media.collection, cold_media] if COLD_TIER_DAYS else [Media.collection]:
+        file_ids = [doc['_id'] async for doc in collection.find(query, {'_id': 1})]
+        if not file_ids:
+            continue
+        result = await collection.delete_many({'_id': {'$in': file_ids}})
+        known_file_ids.discard(file_ids)
+        deleted += result.deleted_count
+    return deleted
+
+async def delete_all_media():
+    """Drop every stored file, including the cold tier."""
+    await Media.collection.drop()
+    if COLD_TIER_DAYS:
+        await cold_media.drop()
+    known_file_ids.reset()
+
+async def delete_source_files(source_chat):
+    """
+    Delete every file indexed only from `source_chat`, and unlink it from the
+    files other source chats hold a copy of. Returns the number deleted.
+    """
+    source_chat = int(source_chat)
+    only_source = {'$or': [
+        {'source_chats': {'$exists': False}, 'source_chat': source_chat},
+        {'source_chats': {'$all': [source_chat], '$not': {'$elemMatch': {'$ne': source_chat}}}},
+    ]}
+    deleted = 0
+    for collection in [Media.collection, cold_media] if COLD_TIER_DAYS else [Media.collection]:
+        deleted += (await collection.delete_many(only_source)).deleted_count
+        await collection.update_many({'source_chats': source_chat}, {'$pull': {'source_chats': source_chat}})
+    known_file_ids.reset()
+    return deleted
+
+async def remove_near_duplicates(dry_run=False):
+    """
+    Collapse files stored more than once under different file_ids, i.e. reposts
+    of the same release with the same title key (or name), size and mime type,
+    also across channels. The lowest file_id of each group is kept, and the
+    source chats of the removed copies are added to its source_chats, so
+    /setsources and /dropsource still see the release in each of them.
+    Grouping runs on the server with allowDiskUse and only groups with
+    duplicates come back, handled in batches of DEDUP_DELETE_SIZE, so memory
+    stays bounded on any collection size. The cold tier is swept on its own;
+    a copy there that duplicates a hot file is caught once it is promoted.
+    Returns (groups, deleted, examples); nothing is changed if `dry_run`.
+    """
+    pipeline = [
+        {'$group': {
+            '_id': {'title': {'$ifNull': ['$title_key', '$file_name']}, 'size': '$file_size', 'mime': '$mime_type'},
+            'keep': {'$min': '$_id'},
+            'ids': {'$push': '$_id'},
+            'name': {'$first': '$file_name'},
+            'source_chat': {'$addToSet': '$source_chat'},
+            'source_chats': {'$addToSet': '$source_chats'},
+        }},
+        {'$match': {'ids.1': {'$exists': True}}},
+    ]
+    groups = deleted = 0
+    examples = []
+    pending = []
+    merges = []
+
+    async def flush(collection):
+        nonlocal deleted
+        if not dry_run:
+            # Sources are merged first, so an interrupted sweep never loses one
+            if merges:
+                await collection.bulk_write(merges, ordered=False)
+            result = await collection.delete_many({'_id': {'$in': pending}})
+            known_file_ids.discard(pending)
+            deleted += result.deleted_count
+        else:
+            deleted += len(pending)
+        pending.clear()
+        merges.clear()
+
+    for collection in [Media.collection, cold_media] if COLD_TIER_DAYS else [Media.collection]:
+        async for group in collection.aggregate(pipeline, allowDiskUse=True):
+            groups += 1
+            pending.extend(file_id for file_id in group['ids'] if file_id != group['keep'])
+            sources = set(group['source_chat'])
+            for chats in group['source_chats']:
+                sources.update(chats or [])
+            sources.discard(None)
+            if sources:
+                merges.append(UpdateOne({'_id': group['keep']}, {'$addToSet': {'source_chats': {'$each': sorted(sources)}}}))
+            if len(examples) < DEDUP_EXAMPLES:
+                examples.append(f"{group['name']} ({len(group['ids']) - 1} removed)")
+            if len(pending) >= DEDUP_DELETE_SIZE:
+                await flush(collection)
+        if pending:
+            await flush(collection)
+    logger.info(f"Near-duplicate sweep: {deleted} files in {groups} groups{' (dry run)' if dry_run else ''}")
+    return groups, deleted, examples
+
+async def get_search_results_batch(queries, file_type=None, max_results=3):
+    """
+    Search many queries at once, e.g. to check a list of titles for availability.
+    Each chunk of BATCH_SEARCH_SIZE queries is answered by a single aggregation:
+    one $match over the union of the queries, then a $facet per query with its
+    hit count and first `max_results` matches, newest first like get_search_results.
+    Returns a list of (results, total_results) aligned with `queries`; the
+    entries of queries whose chunk failed are None, so an error can't pass
+    for "not available".
+    """
+    output = [([], 0) for _ in queries]
+    filters = [(i, get_search_filter(query, file_type)) for i, query in enumerate(queries)]
+    filters = [(i, f) for i, f in filters if f is not None]
+
+    async def search_chunk(collection, chunk):
+        facets = {}
+        for i, mongo_filter in chunk:
+            facets[f'n{i}'] = [{'$match': mongo_filter}, {'$count': 'total'}]
+            facets[f'r{i}'] = [{'$match': mongo_filter}, {'$sort': {'indexed_at': -1}}, {'$limit': max_results}]
+        pipeline = [
+            {'$match': {'$or': [mongo_filter for _, mongo_filter in chunk]}},
+            {'$facet': facets},
+        ]
+        try:
+            async for doc in collection.aggregate(pipeline, allowDiskUse=True):
+                for i, _ in chunk:
+                    counted = doc[f'n{i}']
+                    files = [Media.build_from_mongo(raw) for raw in doc[f'r{i}']]
+                    output[i] = (files, counted[0]['total'] if counted else 0)
+        except Exception as e:
+            logger.exception(f"Error in batch search: {e}")
+            for i, _ in chunk:
+                output[i] = None
+
+    for start in range(0, len(filters), BATCH_SEARCH_SIZE):
+        await search_chunk(Media.collection, filters[start:start + BATCH_SEARCH_SIZE])
+    if COLD_TIER_DAYS:
+        # Queries without a hot match fall through to the cold tier, like get_search_results
+        missed = [(i, f) for i, f in filters if output[i] is not None and not output[i][1]]
+        for start in range(0, len(missed), BATCH_SEARCH_SIZE):
+            await search_chunk(cold_media, missed[start:start + BATCH_SEARCH_SIZE])
+    record_media_hits(file.file_id for result in output if result for file in result[0])
+    return output
+
+async def get_bad_files(query, file_type=None, filter=False):
+    """
+    Get all files matching query (no pagination), including the cold tier.
+    Returns (results, total_results).
+    """
+    mongo_filter = get_search_filter(query, file_type)
+    if mongo_filter is None:
+        return [], 0
+
+    try:
+        cursor = Media.find(mongo_filter).sort('indexed_at', DESCENDING)
         files = await cursor.to_list(length=None)  # Fetch all
+        if COLD_TIER_DAYS:
+            files += [Media.build_from_mongo(doc) async for doc in cold_media.find(mongo_filter)]
         total_results = len(files)
         return files, total_results
     except Exception as e:
@@ -145,11 +815,81 @@ async def get_file_details(file_id):
     """Get file details by file_id."""
     try:
         cursor = Media.find({'file_id': file_id}).limit(1)
-        return await cursor.to_list(length=1)
+        files = await cursor.to_list(length=1)
+        if not files and COLD_TIER_DAYS:
+            file = await promote_cold_media(file_id)
+            files = [file] if file else []
+        record_media_hits(file.file_id for file in files)
+        return files
     except Exception as e:
         logger.exception(f"Error fetching file details for '{file_id}': {e}")
         return []
 
+# Files searched or delivered since the hits were last written to last_hit
+media_hits = set()
+
+def record_media_hits(file_ids):
+    """Remember that `file_ids` were just served, keeping them in the hot tier."""
+    if COLD_TIER_DAYS:
+        media_hits.update(file_ids)
+
+async def flush_media_hits():
+    """Stamp last_hit on the files served since the last flush, in bulk."""
+    hits = list(media_hits)
+    media_hits.clear()
+    now = datetime.datetime.utcnow()
+    for i in range(0, len(hits), TIER_BATCH_SIZE):
+        await Media.collection.update_many({'_id': {'$in': hits[i:i + TIER_BATCH_SIZE]}}, {'$set': {'last_hit': now}})
+
+async def search_cold_media(mongo_filter, offset, max_results):
+    """Search the cold tier. Returns (results, total_results) like the hot search."""
+    total_results = await cold_media.count_documents(mongo_filter)
+    if not total_results:
+        return [], 0
+    cursor = cold_media.find(mongo_filter).sort('indexed_at', DESCENDING).skip(offset).limit(max_results)
+    return [Media.build_from_mongo(doc) for doc in await cursor.to_list(length=max_results)], total_results
+
+async def promote_cold_media(file_id):
+    """Move a file that was just requested from the cold tier back to the hot one. Returns it, or None."""
+    doc = await cold_media.find_one({'_id': file_id})
+    if doc is None:
+        return None
+    doc['last_hit'] = datetime.datetime.utcnow()
+    try:
+        await Media.collection.insert_one(doc)
+    except DuplicateKeyError:
+        pass
+    await cold_media.delete_one({'_id': file_id})
+    return Media.build_from_mongo(doc)
+
+async def move_cold_media(batch_size=TIER_BATCH_SIZE):
+    """
+    Move files without a hit for COLD_TIER_DAYS to the cold tier in batches.
+    Files indexed before tiering was enabled get their first last_hit stamped
+    now, so they get the full grace period. Returns the number moved.
+    """
+    await flush_media_hits()
+    now = datetime.datetime.utcnow()
+    await Media.collection.update_many({'last_hit': None}, {'$set': {'last_hit': now}})
+    cutoff = now - datetime.timedelta(days=COLD_TIER_DAYS)
+    moved = 0
+    while True:
+        docs = await Media.collection.find({'last_hit': {'$lt': cutoff}}).limit(batch_size).to_list(length=batch_size)
+        if not docs:
+            break
+        try:
+            await cold_media.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            # Files a previous interrupted move already copied
+            if any(error.get('code') != 11000 for error in e.details.get('writeErrors', [])):
+                raise
+        # A hit that came in meanwhile keeps the file hot
+        result = await Media.collection.delete_many({'_id': {'$in': [doc['_id'] for doc in docs]}, 'last_hit': {'$lt': cutoff}})
+        moved += result.deleted_count
+        await asyncio.sleep(TIER_PAUSE)
+    logger.info(f"Moved {moved} files to the cold tier")
+    return moved
+
 # File ID encoding/decoding utilities
 def encode_file_id(s: bytes) -> str:
     r = b""
@@ -0,0 +1,46 @@
+import logging
+import datetime
+from motor.motor_asyncio import AsyncIOMotorClient
+from info import DATABASE_URI, DATABASE_NAME
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.ERROR)
+
+# Initialize async MongoDB client
+client = AsyncIOMotorClient(DATABASE_URI)
+mydb = client[DATABASE_NAME]
+mycol = mydb['INDEX_JOBS']
+synccol = mydb['SOURCE_SYNC']
+
+
+async def save_index_job(chat, **data):
+    """Create or update the persisted state of the indexing job for `chat`."""
+    data['updated'] = datetime.datetime.utcnow()
+    try:
+        await mycol.update_one({'_id': chat}, {'$set': data}, upsert=True)
+    except Exception as e:
+        logger.exception(f"Error saving index job for '{chat}': {e}")
+
+
+async def get_index_job(chat):
+    """Get the persisted state of the indexing job for `chat`, if any."""
+    return await mycol.find_one({'_id': chat})
+
+
+async def get_running_index_jobs():
+    """Get every job that was still running when it was last checkpointed."""
+    return await mycol.find({'status': 'running'}).to_list(length=None)
+
+
+async def get_synced_id(chat_id):
+    """Get the highest message ID of `chat_id` known to be indexed, or None."""
+    state = await synccol.find_one({'_id': int(chat_id)})
+    return state['last_msg_id'] if state else None
+
+
+async def update_synced_id(chat_id, msg_id):
+    """Raise the highest indexed message ID of `chat_id` to `msg_id`."""
+    try:
+        await synccol.update_one({'_id': int(chat_id)}, {'$max': {'last_msg_id': int(msg_id)}}, upsert=True)
+    except Exception as e:
+        logger.exception(f"Error updating sync state of '{chat_id}': {e}")
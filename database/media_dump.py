@@ -0,0 +1,131 @@
+"""
+Export and import of the Media collection without going through Telegram.
+
+    python3 -m database.media_dump export media.bson.gz
+    python3 -m database.media_dump import media.bson.gz
+
+Exports include the cold tier. Imports load everything into the hot
+collection; the next tiering pass moves files without recent hits back.
+
+The dump is a gzip-compressed stream of BSON documents, each prefixed with its
+own length as BSON is, i.e. the format of mongodump's .bson files. Documents
+are copied as raw BSON both ways, so they are never decoded into Python
+objects; imports are written with unordered insert_many calls, several at once.
+"""
+import gzip
+import time
+import struct
+import asyncio
+import logging
+import argparse
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+from pymongo.errors import BulkWriteError
+from database.ia_filterdb import Media, cold_media, ensure_indexes
+from info import COLD_TIER_DAYS
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Documents per insert_many call, and insert_many calls in flight at once
+IMPORT_BATCH_SIZE = 1000
+IMPORT_CONCURRENCY = 4
+# Documents fetched per cursor batch while exporting
+EXPORT_BATCH_SIZE = 5000
+
+RAW_OPTIONS = CodecOptions(document_class=RawBSONDocument)
+
+
+def raw_collection(collection=None):
+    return (Media.collection if collection is None else collection).with_options(codec_options=RAW_OPTIONS)
+
+
+async def export_media(path, compresslevel=6):
+    """Write every Media document, hot and cold, to `path`. Returns the document count."""
+    count = 0
+    with gzip.open(path, 'wb', compresslevel=compresslevel) as f:
+        for collection in [Media.collection, cold_media] if COLD_TIER_DAYS else [Media.collection]:
+            async for doc in raw_collection(collection).find({}, batch_size=EXPORT_BATCH_SIZE):
+                f.write(doc.raw)
+                count += 1
+                if count % 100000 == 0:
+                    logger.info(f"Exported {count} files")
+    return count
+
+
+def read_documents(f):
+    """Yield the raw BSON documents of an open dump file."""
+    while True:
+        header = f.read(4)
+        if not header:
+            return
+        if len(header) < 4:
+            raise ValueError('Truncated dump file')
+        size, = struct.unpack('<i', header)
+        body = f.read(size - 4)
+        if len(body) < size - 4:
+            raise ValueError('Truncated dump file')
+        yield RawBSONDocument(header + body)
+
+
+async def import_media(path, batch_size=IMPORT_BATCH_SIZE, concurrency=IMPORT_CONCURRENCY):
+    """
+    Load the dump at `path` into the Media collection. Files already in the
+    collection are skipped. Returns the (saved, duplicate) counts.
+    """
+    collection = raw_collection()
+    slots = asyncio.Semaphore(concurrency)
+    counts = {'saved': 0, 'duplicate': 0}
+    tasks = set()
+
+    async def insert(batch):
+        try:
+            result = await collection.insert_many(batch, ordered=False)
+            counts['saved'] += len(result.inserted_ids)
+        except BulkWriteError as e:
+            errors = e.details.get('writeErrors', [])
+            duplicate = sum(1 for error in errors if error.get('code') == 11000)
+            counts['saved'] += e.details.get('nInserted', 0)
+            counts['duplicate'] += duplicate
+            if duplicate < len(errors):
+                logger.error(f"{len(errors) - duplicate} files failed to import: {errors[0].get('errmsg')}")
+        finally:
+            slots.release()
+
+    with gzip.open(path, 'rb') as f:
+        batch = []
+        for doc in read_documents(f):
+            batch.append(doc)
+            if len(batch) < batch_size:
+                continue
+            await slots.acquire()
+            task = asyncio.create_task(insert(batch))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            batch = []
+        if batch:
+            await slots.acquire()
+            tasks.add(asyncio.create_task(insert(batch)))
+        await asyncio.gather(*tasks)
+    await ensure_indexes()
+    return counts['saved'], counts['duplicate']
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('action', choices=['export', 'import'])
+    parser.add_argument('path', help='dump file, gzip-compressed BSON')
+    parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE, help='documents per insert_many on import')
+    parser.add_argument('--concurrency', type=int, default=IMPORT_CONCURRENCY, help='insert_many calls in flight on import')
+    args = parser.parse_args()
+    start = time.time()
+    if args.action == 'export':
+        count = await export_media(args.path)
+        print(f"Exported {count} files to {args.path} in {time.time() - start:.1f}s")
+    else:
+        saved, duplicate = await import_media(args.path, args.batch_size, args.concurrency)
+        print(f"Imported {saved} files from {args.path} in {time.time() - start:.1f}s, {duplicate} were already there")
+
+
+if __name__ == '__main__':
+    asyncio.get_event_loop().run_until_complete(main())
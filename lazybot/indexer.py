@@ -0,0 +1,613 @@
+import time
+import asyncio
+import logging
+from collections import deque
+from pyrogram import enums
+from pyrogram.errors import FloodWait
+from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from database.ia_filterdb import MediaBulkWriter, remove_near_duplicates, move_cold_media
+from database.index_jobs_db import save_index_job, get_index_job, get_running_index_jobs, get_synced_id, update_synced_id
+from info import INDEX_CONCURRENCY, INDEX_FETCHES_PER_CLIENT, CHANNELS, DEDUP_INTERVAL, COLD_TIER_DAYS
+from utils import temp
+from . import multi_clients
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Message IDs requested per get_messages call (Telegram's limit)
+FETCH_SIZE = 200
+# Fetched batches per client allowed to wait for the writer before fetching pauses
+PREFETCH_BATCHES = 4
+# Seconds between two edits of a job's progress message
+PROGRESS_INTERVAL = 10
+# Seconds between two persisted checkpoints of a running job
+CHECKPOINT_INTERVAL = 30
+# Finished jobs kept around for /indexjobs
+FINISHED_JOBS_KEPT = 20
+# Consecutive empty batches after which a startup catch-up assumes it reached the end
+SYNC_EMPTY_BATCHES = 3
+# Live channel media written per batch, at the latest after LIVE_FLUSH_INTERVAL seconds
+LIVE_BATCH_SIZE = 100
+LIVE_FLUSH_INTERVAL = 2
+# Seconds between two moves of unused files to the cold tier
+TIERING_INTERVAL = 60 * 60
+# Live channel media allowed to wait for a write before handlers are slowed down
+LIVE_QUEUE_SIZE = 5000
+
+SUPPORTED_MEDIA = [enums.MessageMediaType.VIDEO, enums.MessageMediaType.AUDIO, enums.MessageMediaType.DOCUMENT]
+
+# Source channels whose startup catch-up finished. Live ingest only raises the
+# recorded high-water mark of these, so a post arriving before a channel's
+# catch-up read its mark can't push the mark past the messages it missed
+synced_chats = set()
+
+# Limits the get_messages calls all index jobs together have in flight on one
+# client, so indexing never takes every connection away from interactive handlers
+fetch_slots = {}
+
+
+class IndexStats:
+    """Counters of one indexing run."""
+
+    def __init__(self, current: int = 0):
+        self.current = current
+        self.deleted = 0
+        self.no_media = 0
+        self.unsupported = 0
+        self.writer = MediaBulkWriter()
+
+    COUNTERS = ('current', 'deleted', 'no_media', 'unsupported')
+    WRITER_COUNTERS = ('saved', 'duplicate', 'errors')
+
+    def to_dict(self):
+        counters = {name: getattr(self, name) for name in self.COUNTERS}
+        counters.update((name, getattr(self.writer, name)) for name in self.WRITER_COUNTERS)
+        return counters
+
+    @classmethod
+    def from_dict(cls, counters):
+        stats = cls()
+        for name in cls.COUNTERS:
+            setattr(stats, name, counters.get(name, 0))
+        for name in cls.WRITER_COUNTERS:
+            setattr(stats.writer, name, counters.get(name, 0))
+        return stats
+
+    @property
+    def saved(self):
+        return self.writer.saved
+
+    @property
+    def duplicate(self):
+        return self.writer.duplicate
+
+    @property
+    def errors(self):
+        return self.writer.errors
+
+    async def add(self, message):
+        """Count `message` and hand its media to the bulk writer."""
+        self.current += 1
+        if message.empty:
+            self.deleted += 1
+            return
+        if not message.media:
+            self.no_media += 1
+            return
+        if message.media not in SUPPORTED_MEDIA:
+            self.unsupported += 1
+            return
+        media = getattr(message, message.media.value, None)
+        if not media:
+            self.unsupported += 1
+            return
+        media.file_type = message.media.value
+        media.caption = message.caption
+        media.source_chat = message.chat.id
+        await self.writer.add(media, tag=(message.chat.id, message.id))
+
+
+def sync_marks(highest, failed):
+    """
+    Return the sync mark to record for each chat of `highest`, which maps chats
+    to the highest message ID read from them: that ID, held below the chat's
+    first (chat, message ID) in `failed`, so a catch-up retries that file.
+    """
+    marks = dict(highest)
+    for chat_id, msg_id in failed:
+        if chat_id in marks:
+            marks[chat_id] = min(marks[chat_id], msg_id - 1)
+    return marks
+
+
+async def get_index_clients(bot, chat):
+    """
+    Return `bot` and every MULTI_TOKEN client that can read `chat`. The other
+    clients scan ranges for media; the media itself is always fetched by `bot`.
+    """
+    clients = [bot]
+    for client_id, client in multi_clients.items():
+        if client is bot:
+            continue
+        try:
+            await client.get_chat(chat)
+        except Exception as e:
+            logger.info(f"Client {client_id} can't read {chat}, not using it for indexing: {e}")
+        else:
+            clients.append(client)
+    return clients
+
+
+def split_batches(offset, lst_msg_id):
+    """Split message IDs `offset`..`lst_msg_id` into (start, end) ranges of FETCH_SIZE."""
+    return deque(
+        (start, min(start + FETCH_SIZE, lst_msg_id + 1))
+        for start in range(offset, lst_msg_id + 1, FETCH_SIZE)
+    )
+
+
+def is_media(message):
+    return not message.empty and message.media in SUPPORTED_MEDIA
+
+
+async def scan_batches(client, chat, batches, refetch, queue):
+    """
+    Producer stage of a MULTI_TOKEN client: take ranges from the shared
+    `batches` deque and fetch them with `client`. A file_id carries the access
+    hash of the bot that fetched it and only that bot can send it, so the IDs
+    of media messages go to the shared `refetch` deque for `bot`; only the
+    deleted and non-media messages are put on `queue`. A range that hits a
+    FloodWait goes back to the deque while this client sleeps it out.
+    Ends with None, or with the exception that stopped it.
+    """
+    try:
+        while batches:
+            start, end = batches.popleft()
+            slot = fetch_slots.setdefault(client, asyncio.Semaphore(INDEX_FETCHES_PER_CLIENT))
+            try:
+                async with slot:
+                    messages = await client.get_messages(chat, list(range(start, end)))
+            except FloodWait as e:
+                batches.appendleft((start, end))
+                logger.warning(f"FloodWait of {e.value}s for client {client.name} while fetching {chat}")
+                await asyncio.sleep(e.value)
+                continue
+            refetch.extend(message.id for message in messages if is_media(message))
+            await queue.put([message for message in messages if not is_media(message)])
+        await queue.put(None)
+    except Exception as e:
+        await queue.put(e)
+
+
+async def fetch_batches(bot, chat, batches, refetch, scanners, queue):
+    """
+    Producer stage of `bot`: fetch the media IDs the `scanners` found in full
+    FETCH_SIZE calls across ranges, and scan ranges itself while fewer are
+    waiting. Every message it puts on `queue` is stored as fetched.
+    Ends with None, or with the exception that stopped it.
+    """
+    slot = fetch_slots.setdefault(bot, asyncio.Semaphore(INDEX_FETCHES_PER_CLIENT))
+    try:
+        while True:
+            scanning = not all(scanner.done() for scanner in scanners)
+            if len(refetch) >= FETCH_SIZE or (refetch and not batches and not scanning):
+                ids = [refetch.popleft() for _ in range(min(FETCH_SIZE, len(refetch)))]
+                retry = lambda: refetch.extendleft(reversed(ids))
+            elif batches:
+                start, end = batches.popleft()
+                ids = list(range(start, end))
+                retry = lambda: batches.appendleft((start, end))
+            elif scanning:
+                # Wait for the scanners to collect a denser call
+                await asyncio.sleep(0.1)
+                continue
+            else:
+                break
+            try:
+                async with slot:
+                    messages = await bot.get_messages(chat, ids)
+            except FloodWait as e:
+                retry()
+                logger.warning(f"FloodWait of {e.value}s for client {bot.name} while fetching {chat}")
+                await asyncio.sleep(e.value)
+                continue
+            await queue.put(messages)
+        await queue.put(None)
+    except Exception as e:
+        await queue.put(e)
+
+
+async def index_chat(bot, chat, lst_msg_id, offset, stats, checkpoint=None, cancelled=None):
+    """
+    Index messages `offset`..`lst_msg_id` of `chat` into the Media collection.
+    The range is scanned concurrently by every client that can read the chat.
+    MULTI_TOKEN clients sort out deleted and non-media messages, and `bot`
+    fetches the media they found in dense batches, as only its file_ids can
+    be sent. Fetches run ahead of parsing and writing through a bounded queue,
+    so they overlap with each other and with the bulk inserts.
+    Only `stats` is updated as messages are processed; reporting it is left to
+    the caller, so the loop never waits on Telegram's edit limits.
+    `checkpoint` is awaited with `stats` and the resume point every
+    CHECKPOINT_INTERVAL seconds, once everything below that point is written.
+    The stats include ranges above that point which finished early; a job
+    resumed from it counts those again, so its totals are approximate.
+    Returns False if `cancelled()` turned true during the run, True otherwise.
+    """
+    clients = await get_index_clients(bot, chat)
+    batches = split_batches(offset, lst_msg_id)
+    # Messages of each range not processed yet; the lowest unfinished range is where a restart resumes
+    left = {start: end - start for start, end in batches}
+    refetch = deque()
+    queue = asyncio.Queue(maxsize=PREFETCH_BATCHES * len(clients))
+    scanners = [asyncio.create_task(scan_batches(client, chat, batches, refetch, queue)) for client in clients[1:]]
+    producers = scanners + [asyncio.create_task(fetch_batches(bot, chat, batches, refetch, scanners, queue))]
+    running = len(producers)
+    last_checkpoint = time.monotonic()
+    try:
+        while running:
+            messages = await queue.get()
+            if messages is None:
+                running -= 1
+                continue
+            if isinstance(messages, Exception):
+                raise messages
+            for message in messages:
+                if cancelled and cancelled():
+                    return False
+                await stats.add(message)
+                start = offset + (message.id - offset) // FETCH_SIZE * FETCH_SIZE
+                if start in left:
+                    left[start] -= 1
+                    if not left[start]:
+                        del left[start]
+            if checkpoint and time.monotonic() - last_checkpoint >= CHECKPOINT_INTERVAL:
+                await stats.writer.flush()
+                await checkpoint(stats, min(left, default=lst_msg_id + 1))
+                last_checkpoint = time.monotonic()
+            # Parsing a batch doesn't await; give queued user updates their turn
+            await asyncio.sleep(0)
+        return True
+    finally:
+        for producer in producers:
+            producer.cancel()
+        await stats.writer.flush()
+
+
+class IndexJob:
+    """One queued or running channel index, identified by `id`."""
+
+    def __init__(self, job_id: int, chat, lst_msg_id: int, msg, bot):
+        self.id = job_id
+        self.chat = chat
+        self.lst_msg_id = lst_msg_id
+        self.msg = msg
+        self.bot = bot
+        self.status = 'queued'
+        self.cancelled = False
+        self.stats = None
+        self.started = None
+
+    def reply_markup(self):
+        return InlineKeyboardMarkup([[InlineKeyboardButton('Cancel', callback_data=f'index_cancel#{self.id}')]])
+
+    def to_dict(self):
+        """JSON-serializable status of the job, as served by the /index/jobs route."""
+        elapsed = time.time() - self.started if self.started else 0
+        counters = self.stats.to_dict() if self.stats else {}
+        return {
+            'id': self.id,
+            'chat': self.chat,
+            'status': self.status,
+            'lst_msg_id': self.lst_msg_id,
+            'elapsed': round(elapsed, 1),
+            'rate': round(counters.get('current', 0) / elapsed, 1) if elapsed else 0,
+            'counters': counters,
+        }
+
+
+class IndexJobManager:
+    """
+    Queue of index jobs run by `concurrency` workers, so several channels can be
+    queued at once and indexed in parallel within that limit.
+    """
+
+    def __init__(self, concurrency: int):
+        self.concurrency = max(1, concurrency)
+        self.jobs = {}
+        self.queue = asyncio.Queue()
+        self.workers = []
+        self.next_id = 1
+
+    def active(self, chat=None):
+        """Return queued and running jobs, optionally only those for `chat`."""
+        return [
+            job for job in self.jobs.values()
+            if job.status in ('queued', 'running') and (chat is None or job.chat == chat)
+        ]
+
+    def submit(self, lst_msg_id, chat, msg, bot):
+        """Queue an index of `chat`. Returns the job, or None if one is already active."""
+        if self.active(chat):
+            return None
+        job = IndexJob(self.next_id, chat, lst_msg_id, msg, bot)
+        self.next_id += 1
+        self.jobs[job.id] = job
+        self.queue.put_nowait(job)
+        while len(self.workers) < self.concurrency:
+            self.workers.append(asyncio.create_task(self.worker()))
+        return job
+
+    def cancel(self, job_id=None):
+        """Cancel one job, or every active job if `job_id` is None. Returns the cancelled count."""
+        if job_id is None:
+            jobs = self.active()
+        else:
+            jobs = [job for job in self.active() if job.id == job_id]
+        for job in jobs:
+            job.cancelled = True
+        return len(jobs)
+
+    async def worker(self):
+        while True:
+            job = await self.queue.get()
+            if job.cancelled:
+                job.status = 'cancelled'
+                await save_index_job(job.chat, status='cancelled')
+                try:
+                    await job.msg.edit(f'Job <code>#{job.id}</code> was cancelled before it started.')
+                except Exception:
+                    pass
+                continue
+            job.status = 'running'
+            try:
+                await index_files_to_db(job.lst_msg_id, job.chat, job.msg, job.bot, job)
+            except Exception as e:
+                logger.exception(e)
+                job.status = 'failed'
+            self.prune()
+
+    def prune(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.status not in ('queued', 'running')]
+        for job_id in finished[:-FINISHED_JOBS_KEPT]:
+            del self.jobs[job_id]
+
+
+index_jobs = IndexJobManager(INDEX_CONCURRENCY)
+
+
+async def index_files_to_db(lst_msg_id, chat, msg, bot, job=None):
+    """
+    Run an indexing job for `chat` and report on `msg`. The job state is
+    checkpointed to Mongo, so a running job for the same chat is continued from
+    its checkpoint instead of starting over at temp.CURRENT.
+    """
+    job = job or IndexJob(0, chat, lst_msg_id, msg, bot)
+
+    async def report_progress(stats):
+        # Runs beside the index; a FloodWait here only delays the next report
+        last = None
+        while True:
+            await asyncio.sleep(PROGRESS_INTERVAL)
+            if job.status != 'running':
+                return
+            if stats.current == last:
+                continue
+            last = stats.current
+            try:
+                await msg.edit_text(
+                    text=f"Job <code>#{job.id}</code>\nTotal messages fetched: <code>{stats.current}</code>\nTotal messages saved: <code>{stats.saved}</code>\nDuplicate Files Skipped: <code>{stats.duplicate}</code>\nDeleted Messages Skipped: <code>{stats.deleted}</code>\nNon-Media messages skipped: <code>{stats.no_media + stats.unsupported}</code>(Unsupported Media - `{stats.unsupported}` )\nErrors Occurred: <code>{stats.errors}</code>",
+                    reply_markup=job.reply_markup())
+            except FloodWait as e:
+                await asyncio.sleep(e.value)
+            except Exception as e:
+                logger.warning(f"Could not report progress of job #{job.id}: {e}")
+
+    async def checkpoint(stats, resume_from):
+        await save_index_job(chat, resume_from=resume_from, counters=stats.to_dict())
+
+    saved_job = await get_index_job(chat)
+    if saved_job and saved_job.get('status') == 'running' and saved_job.get('lst_msg_id') == lst_msg_id:
+        offset = saved_job['resume_from']
+        stats = IndexStats.from_dict(saved_job.get('counters', {}))
+        # Ranges written past the checkpoint before the restart are counted again
+        note = '\n\nResumed after a restart, so the counts are approximate.'
+        logger.info(f"Resuming indexing of {chat} from message {offset}, counts will be approximate")
+    else:
+        offset = temp.CURRENT
+        stats = IndexStats(temp.CURRENT)
+        note = ''
+    job.stats = stats
+    job.status = 'running'
+    job.started = time.time()
+    await save_index_job(
+        chat, status='running', lst_msg_id=lst_msg_id, resume_from=offset, counters=stats.to_dict(),
+        msg_chat=msg.chat.id, msg_id=msg.id
+    )
+    reporter = asyncio.create_task(report_progress(stats))
+    try:
+        completed = await index_chat(bot, chat, lst_msg_id, offset, stats, checkpoint, lambda: job.cancelled)
+    except Exception as e:
+        logger.exception(e)
+        job.status = 'failed'
+        await save_index_job(chat, status='failed', counters=stats.to_dict())
+        await msg.edit(f'Error: {e}')
+    else:
+        job.status = 'done' if completed else 'cancelled'
+        await save_index_job(chat, status=job.status, counters=stats.to_dict())
+        if completed:
+            try:
+                chat_id = (await bot.get_chat(chat)).id
+                await update_synced_id(chat_id, sync_marks({chat_id: lst_msg_id}, stats.writer.failed_tags)[chat_id])
+            except Exception as e:
+                logger.warning(f"Could not record sync state of {chat}: {e}")
+        if completed:
+            await msg.edit(f'Succesfully saved <code>{stats.saved}</code> to dataBase!\nDuplicate Files Skipped: <code>{stats.duplicate}</code>\nDeleted Messages Skipped: <code>{stats.deleted}</code>\nNon-Media messages skipped: <code>{stats.no_media + stats.unsupported}</code>(Unsupported Media - `{stats.unsupported}` )\nErrors Occurred: <code>{stats.errors}</code>{note}')
+        else:
+            await msg.edit(f"Successfully Cancelled!!\n\nSaved <code>{stats.saved}</code> files to dataBase!\nDuplicate Files Skipped: <code>{stats.duplicate}</code>\nDeleted Messages Skipped: <code>{stats.deleted}</code>\nNon-Media messages skipped: <code>{stats.no_media + stats.unsupported}</code>(Unsupported Media - `{stats.unsupported}` )\nErrors Occurred: <code>{stats.errors}</code>{note}")
+    finally:
+        reporter.cancel()
+
+
+async def resume_index_jobs(bot):
+    """Queue again the jobs a restart interrupted; they continue from their checkpoints."""
+    for saved_job in await get_running_index_jobs():
+        try:
+            msg = await bot.get_messages(saved_job['msg_chat'], saved_job['msg_id'])
+        except Exception as e:
+            logger.warning(f"Can't resume indexing of {saved_job['_id']}, progress message is gone: {e}")
+            await save_index_job(saved_job['_id'], status='failed')
+            continue
+        index_jobs.submit(saved_job['lst_msg_id'], saved_job['_id'], msg, bot)
+
+
+async def sync_source_chat(bot, chat):
+    """
+    Index the messages posted to source channel `chat` after the highest
+    message ID recorded for it, i.e. the ones posted while the bot was down.
+    Telegram gives bots no way to read the latest message ID, so batches are
+    fetched until SYNC_EMPTY_BATCHES in a row come back empty.
+    Returns the stats of the catch-up, or None if the chat was never indexed.
+    """
+    chat_id = (await bot.get_chat(chat)).id
+    last = await get_synced_id(chat_id)
+    if last is None:
+        logger.info(f"{chat} has no recorded sync state, index it once with /index to enable catch-up")
+        synced_chats.add(chat_id)
+        return None
+    stats = IndexStats()
+    current, highest, empty = last + 1, last, 0
+    try:
+        while empty < SYNC_EMPTY_BATCHES:
+            try:
+                messages = await bot.get_messages(chat_id, list(range(current, current + FETCH_SIZE)))
+            except FloodWait as e:
+                await asyncio.sleep(e.value)
+                continue
+            found = [message for message in messages if not message.empty]
+            if found:
+                empty = 0
+                highest = max(message.id for message in found)
+            else:
+                empty += 1
+            for message in found:
+                await stats.add(message)
+            current += FETCH_SIZE
+    finally:
+        await stats.writer.flush()
+    mark = sync_marks({chat_id: highest}, stats.writer.failed_tags)[chat_id]
+    if mark > last:
+        await update_synced_id(chat_id, mark)
+    synced_chats.add(chat_id)
+    logger.info(f"Caught up {chat} from message {last + 1} to {highest}: saved {stats.saved}, {stats.duplicate} duplicates")
+    return stats
+
+
+async def sync_source_chats(bot):
+    """Catch up every chat in CHANNELS on files posted while the bot was down."""
+    for chat in CHANNELS:
+        try:
+            await sync_source_chat(bot, chat)
+        except Exception as e:
+            logger.exception(f"Catch-up of {chat} failed: {e}")
+
+
+async def remove_near_duplicates_periodically():
+    """Run a near-duplicate sweep every DEDUP_INTERVAL hours, between index jobs."""
+    if DEDUP_INTERVAL <= 0:
+        return
+    while True:
+        await asyncio.sleep(DEDUP_INTERVAL * 60 * 60)
+        if index_jobs.active():
+            logger.info("Index jobs running, skipping this near-duplicate sweep")
+            continue
+        try:
+            groups, deleted, examples = await remove_near_duplicates()
+        except Exception as e:
+            logger.exception(f"Near-duplicate sweep failed: {e}")
+            continue
+        if deleted:
+            logger.info(f"Removed {deleted} near-duplicate files, e.g. {'; '.join(examples)}")
+
+
+async def move_cold_media_periodically():
+    """Every TIERING_INTERVAL, record the latest hits and move files unused for COLD_TIER_DAYS to the cold tier."""
+    if COLD_TIER_DAYS <= 0:
+        return
+    while True:
+        await asyncio.sleep(TIERING_INTERVAL)
+        try:
+            await move_cold_media()
+        except Exception as e:
+            logger.exception(f"Moving files to the cold tier failed: {e}")
+
+
+class LiveIngestBuffer:
+    """
+    Write-behind buffer for media posted to the source channels. Handlers only
+    enqueue and return; a background task writes the queue in bulk once
+    LIVE_BATCH_SIZE files are waiting or LIVE_FLUSH_INTERVAL seconds passed,
+    so upload bursts don't hold Pyrogram workers in database round trips.
+    The queue is bounded, so a stalled database eventually slows ingest down
+    instead of growing memory without limit.
+    """
+
+    def __init__(self):
+        self.queue = asyncio.Queue(maxsize=LIVE_QUEUE_SIZE)
+        self.task = None
+
+    async def put(self, media, chat_id, msg_id):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+        await self.queue.put((media, chat_id, msg_id))
+
+    async def run(self):
+        closing = False
+        while not closing:
+            batch = [await self.queue.get()]
+            deadline = time.monotonic() + LIVE_FLUSH_INTERVAL
+            while len(batch) < LIVE_BATCH_SIZE and batch[-1] is not None and time.monotonic() < deadline:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    await asyncio.sleep(0.1)
+            if batch[-1] is None:
+                closing = True
+                batch.pop()
+            try:
+                await self.write(batch)
+            except Exception as e:
+                logger.exception(f"Error writing {len(batch)} live files: {e}")
+
+    async def write(self, batch):
+        """
+        Store `batch` and move each channel's sync mark up to the last post
+        before its first file that could not be written, so catch-up reads
+        that file again.
+        """
+        writer = MediaBulkWriter()
+        highest = {}
+        try:
+            for media, chat_id, msg_id in batch:
+                highest[chat_id] = max(highest.get(chat_id, 0), msg_id)
+                try:
+                    await writer.add(media, tag=(chat_id, msg_id))
+                except Exception as e:
+                    logger.exception(f"Error buffering live file {msg_id} of {chat_id}: {e}")
+                    writer.errors += 1
+                    writer.failed_tags.append((chat_id, msg_id))
+        finally:
+            await writer.flush()
+        for chat_id, msg_id in sync_marks(highest, writer.failed_tags).items():
+            if chat_id in synced_chats:
+                await update_synced_id(chat_id, msg_id)
+
+    async def close(self):
+        """Write everything still queued. Called on shutdown."""
+        if self.task is None:
+            return
+        await self.queue.put(None)
+        await self.task
+        self.task = None
+
+
+live_ingest = LiveIngestBuffer()
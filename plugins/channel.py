@@ -1,6 +1,8 @@
-from pyrogram import Client, filters
-from info import CHANNELS
-from database.ia_filterdb import save_file
+from pyrogram import Client, filters, enums
+from info import CHANNELS, ADMINS
+from database.ia_filterdb import delete_source_files
+from lazybot.indexer import live_ingest
+from utils import save_group_settings
 
 media_filter = filters.document | filters.video | filters.audio
 
@@ -17,4 +19,43 @@ async def media(bot, message):
 
     media.file_type = file_type
     media.caption = message.caption
-    await save_file(media)
+    media.source_chat = message.chat.id
+    await live_ingest.put(media, message.chat.id, message.id)
+
+
+@Client.on_message(filters.command('setsources') & filters.group)
+async def set_sources(bot, message):
+    """Limit a group's searches to files indexed from the given chats"""
+    userid = message.from_user.id if message.from_user else None
+    if not userid:
+        return
+    st = await bot.get_chat_member(message.chat.id, userid)
+    if (
+            st.status != enums.ChatMemberStatus.ADMINISTRATOR
+            and st.status != enums.ChatMemberStatus.OWNER
+            and userid not in ADMINS
+    ):
+        return
+    try:
+        sources = [int(source) for source in message.command[1:]]
+    except ValueError:
+        return await message.reply('Source chat IDs should be integers.')
+    await save_group_settings(message.chat.id, 'sources', sources)
+    if sources:
+        await message.reply(f"Searches here are now limited to: <code>{' '.join(map(str, sources))}</code>")
+    else:
+        await message.reply('Searches here now cover all indexed chats.')
+
+
+@Client.on_message(filters.command('dropsource') & filters.user(ADMINS))
+async def drop_source(bot, message):
+    """Delete every file indexed from a source chat"""
+    if len(message.command) < 2:
+        return await message.reply('Give me the chat ID whose files should be deleted.')
+    try:
+        source_chat = int(message.command[1])
+    except ValueError:
+        return await message.reply('Chat ID should be an integer.')
+    msg = await message.reply('Processing...⏳')
+    deleted = await delete_source_files(source_chat)
+    await msg.edit(f'Deleted <code>{deleted}</code> files indexed from <code>{source_chat}</code>.')
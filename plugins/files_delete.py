@@ -2,7 +2,7 @@ import re
 import logging
 from pyrogram import Client, filters
 from info import DELETE_CHANNELS
-from database.ia_filterdb import Media, unpack_new_file_id
+from database.ia_filterdb import unpack_new_file_id, delete_media
 
 logger = logging.getLogger(__name__)
 
@@ -22,27 +22,27 @@ async def deletemultiplemedia(bot, message):
 
     file_id, file_ref = unpack_new_file_id(media.file_id)
 
-    result = await Media.collection.delete_one({
+    deleted = await delete_media({
         '_id': file_id,
     })
-    if result.deleted_count:
+    if deleted:
         logger.info('File is successfully deleted from database.')
     else:
         file_name = re.sub(r"(_|\-|\.|\+)", " ", str(media.file_name))
-        result = await Media.collection.delete_many({
+        deleted = await delete_media({
             'file_name': file_name,
             'file_size': media.file_size,
             'mime_type': media.mime_type
             })
-        if result.deleted_count:
+        if deleted:
             logger.info('File is successfully deleted from database.')
         else:
-            result = await Media.collection.delete_many({
+            deleted = await delete_media({
                 'file_name': media.file_name,
                 'file_size': media.file_size,
                 'mime_type': media.mime_type
             })
-            if result.deleted_count:
+            if deleted:
                 logger.info('File is successfully deleted from database.')
             else:
                 logger.info('File not found in database.')
@@ -1,22 +1,23 @@
 import logging
-import asyncio
 from pyrogram import Client, filters, enums
 from pyrogram.errors import FloodWait
 from pyrogram.errors.exceptions.bad_request_400 import ChannelInvalid, ChatAdminRequired, UsernameInvalid, UsernameNotModified
 from info import ADMINS
-from database.ia_filterdb import save_file
+from lazybot.indexer import index_jobs
+from database.ia_filterdb import remove_near_duplicates
+from database.backfill import BACKFILLS, run_backfill
 from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from utils import temp
 import re
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
-lock = asyncio.Lock()
 
 
 @Client.on_callback_query(filters.regex(r'^index'))
 async def index_files(bot, query):
     if query.data.startswith('index_cancel'):
-        temp.CANCEL = True
+        job_id = query.data.split("#")[1] if "#" in query.data else None
+        index_jobs.cancel(int(job_id) if job_id else None)
         return await query.answer("Cancelling Indexing")
     _, raju, chat, lst_msg_id, from_user = query.data.split("#")
     if raju == 'reject':
@@ -26,8 +27,12 @@ async def index_files(bot, query):
                                reply_to_message_id=int(lst_msg_id))
         return
 
-    if lock.locked():
-        return await query.answer('Wait until previous process complete.', show_alert=True)
+    try:
+        chat = int(chat)
+    except:
+        chat = chat
+    if index_jobs.active(chat):
+        return await query.answer('This chat is already being indexed.', show_alert=True)
     msg = query.message
 
     await query.answer('Processing...⏳', show_alert=True)
@@ -35,17 +40,15 @@ async def index_files(bot, query):
         await bot.send_message(int(from_user),
                                f'Your Submission for indexing {chat} has been accepted by our moderators and will be added soon.',
                                reply_to_message_id=int(lst_msg_id))
+    job = index_jobs.submit(int(lst_msg_id), chat, msg, bot)
+    if job is None:
+        # Accepted twice; the first tap queued the job already
+        return
+    waiting = len(index_jobs.active()) - index_jobs.concurrency
     await msg.edit(
-        "Starting Indexing",
-        reply_markup=InlineKeyboardMarkup(
-            [[InlineKeyboardButton('Cancel', callback_data='index_cancel')]]
-        )
+        f"Indexing queued as job <code>#{job.id}</code>" + (f"\nJobs ahead of it: <code>{waiting}</code>" if waiting > 0 else ""),
+        reply_markup=job.reply_markup()
     )
-    try:
-        chat = int(chat)
-    except:
-        chat = chat
-    await index_files_to_db(int(lst_msg_id), chat, msg, bot)
 
 
 @Client.on_message((filters.forwarded | (filters.regex("(https://)?(t\.me/|telegram\.me/|telegram\.dog/)(c/)?(\d+|[a-zA-Z_0-9]+)/(\d+)$")) & filters.text ) & filters.private & filters.incoming)
@@ -133,52 +136,62 @@ async def set_skip_number(bot, message):
         await message.reply("Give me a skip number")
 
 
-async def index_files_to_db(lst_msg_id, chat, msg, bot):
-    total_files = 0
-    duplicate = 0
-    errors = 0
-    deleted = 0
-    no_media = 0
-    unsupported = 0
-    async with lock:
-        try:
-            current = temp.CURRENT
-            temp.CANCEL = False
-            async for message in bot.iter_messages(chat, lst_msg_id, temp.CURRENT):
-                if temp.CANCEL:
-                    await msg.edit(f"Successfully Cancelled!!\n\nSaved <code>{total_files}</code> files to dataBase!\nDuplicate Files Skipped: <code>{duplicate}</code>\nDeleted Messages Skipped: <code>{deleted}</code>\nNon-Media messages skipped: <code>{no_media + unsupported}</code>(Unsupported Media - `{unsupported}` )\nErrors Occurred: <code>{errors}</code>")
-                    break
-                current += 1
-                if current % 20 == 0:
-                    can = [[InlineKeyboardButton('Cancel', callback_data='index_cancel')]]
-                    reply = InlineKeyboardMarkup(can)
-                    await msg.edit_text(
-                        text=f"Total messages fetched: <code>{current}</code>\nTotal messages saved: <code>{total_files}</code>\nDuplicate Files Skipped: <code>{duplicate}</code>\nDeleted Messages Skipped: <code>{deleted}</code>\nNon-Media messages skipped: <code>{no_media + unsupported}</code>(Unsupported Media - `{unsupported}` )\nErrors Occurred: <code>{errors}</code>",
-                        reply_markup=reply)
-                if message.empty:
-                    deleted += 1
-                    continue
-                elif not message.media:
-                    no_media += 1
-                    continue
-                elif message.media not in [enums.MessageMediaType.VIDEO, enums.MessageMediaType.AUDIO, enums.MessageMediaType.DOCUMENT]:
-                    unsupported += 1
-                    continue
-                media = getattr(message, message.media.value, None)
-                if not media:
-                    unsupported += 1
-                    continue
-                media.file_type = message.media.value
-                media.caption = message.caption
-                aynav, vnay = await save_file(media)
-                if aynav:
-                    total_files += 1
-                elif vnay == 0:
-                    duplicate += 1
-                elif vnay == 2:
-                    errors += 1
-        except Exception as e:
-            logger.exception(e)
-            await msg.edit(f'Error: {e}')
-        else:
-            await msg.edit(f'Succesfully saved <code>{total_files}</code> to dataBase!\nDuplicate Files Skipped: <code>{duplicate}</code>\nDeleted Messages Skipped: <code>{deleted}</code>\nNon-Media messages skipped: <code>{no_media + unsupported}</code>(Unsupported Media - `{unsupported}` )\nErrors Occurred: <code>{errors}</code>')
+@Client.on_message(filters.command('indexjobs') & filters.user(ADMINS))
+async def list_index_jobs(bot, message):
+    """List queued, running and recently finished index jobs"""
+    if not index_jobs.jobs:
+        return await message.reply('No index jobs yet.')
+    text = '<b>Index jobs</b>\n'
+    for job in index_jobs.jobs.values():
+        saved = f" - saved <code>{job.stats.saved}</code> of <code>{job.stats.current}</code> fetched" if job.stats else ""
+        text += f"\n<code>#{job.id}</code> <code>{job.chat}</code> {job.status}{saved}"
+    text += '\n\nCancel one with /cancelindex job_id'
+    await message.reply(text)
+
+
+@Client.on_message(filters.command('cancelindex') & filters.user(ADMINS))
+async def cancel_index_job(bot, message):
+    """Cancel a queued or running index job"""
+    if len(message.command) < 2 or not message.command[1].isdigit():
+        return await message.reply('Give me the job ID from /indexjobs.')
+    if index_jobs.cancel(int(message.command[1])):
+        await message.reply(f'Cancelling job #{message.command[1]}.')
+    else:
+        await message.reply('No queued or running job with that ID.')
+
+
+@Client.on_message(filters.command('backfill') & filters.user(ADMINS))
+async def backfill_files(bot, message):
+    """Recompute fields of every stored file, e.g. `/backfill compact`. Add `restart` to start over"""
+    if len(message.command) < 2 or message.command[1] not in BACKFILLS:
+        return await message.reply(f"Usage: /backfill name [restart]\nAvailable: <code>{', '.join(BACKFILLS)}</code>")
+    name = message.command[1]
+    restart = len(message.command) > 2 and message.command[2].lower() == 'restart'
+    msg = await message.reply(f'Running backfill <code>{name}</code>...')
+    try:
+        result = await run_backfill(name, restart=restart)
+    except Exception as e:
+        logger.exception(e)
+        return await msg.edit(f'Error: {e}\nRun it again to continue from the last checkpoint.')
+    if result is None:
+        return await msg.edit(f'Backfill <code>{name}</code> is already running.')
+    scanned, updated, errors = result
+    await msg.edit(f'Backfill <code>{name}</code> updated <code>{updated}</code> of <code>{scanned}</code> files.\nErrors: <code>{errors}</code>')
+
+
+@Client.on_message(filters.command('dedup') & filters.user(ADMINS))
+async def dedup_files(bot, message):
+    """Remove files stored more than once under different file IDs. `/dedup preview` only reports them"""
+    dry_run = len(message.command) > 1 and message.command[1].lower() == 'preview'
+    msg = await message.reply('Looking for near-duplicate files...')
+    try:
+        groups, deleted, examples = await remove_near_duplicates(dry_run=dry_run)
+    except Exception as e:
+        logger.exception(e)
+        return await msg.edit(f'Error: {e}')
+    if not groups:
+        return await msg.edit('No near-duplicate files found.')
+    action = 'Would remove' if dry_run else 'Removed'
+    text = f'{action} <code>{deleted}</code> files from <code>{groups}</code> groups of duplicates.\n\n'
+    text += '\n'.join(f'• <code>{example}</code>' for example in examples)
+    await msg.edit(text)
@@ -2,13 +2,15 @@ import logging
 from pyrogram import Client, emoji, filters
 from pyrogram.errors.exceptions.bad_request_400 import QueryIdInvalid
 from pyrogram.types import InlineKeyboardButton, InlineKeyboardMarkup, InlineQueryResultCachedDocument, InlineQuery
-from database.ia_filterdb import get_search_results
+from database.ia_filterdb import get_search_results, get_grouped_search_results, get_group_variants
 from utils import is_req_subscribed, get_size, temp
-from info import CACHE_TIME, AUTH_USERS, AUTH_CHANNEL, CUSTOM_FILE_CAPTION
+from info import CACHE_TIME, AUTH_USERS, AUTH_CHANNEL, CUSTOM_FILE_CAPTION, GROUP_SEARCH_RESULTS
 from database.connections_mdb import active_connection
 
 logger = logging.getLogger(__name__)
 cache_time = 0 if AUTH_USERS or AUTH_CHANNEL else CACHE_TIME
+# Separates a search from the title key and resolution of the group whose uploads to list
+VARIANTS_MARK = ' ~ '
 
 async def inline_users(query: InlineQuery):
     if AUTH_USERS:
@@ -40,24 +42,51 @@ async def answer(bot, query):
         return
 
     results = []
-    if '|' in query.query:
-        string, file_type = query.query.split('|', maxsplit=1)
+    text, group = query.query, None
+    if VARIANTS_MARK in text:
+        # "search ~ title key ~ resolution", sent by the uploads button of a grouped result
+        text, title, resolution = (text.split(VARIANTS_MARK) + ['', ''])[:3]
+        group = {'title': title.strip(), 'resolution': resolution.strip().strip('-') or None}
+    if '|' in text:
+        string, file_type = text.split('|', maxsplit=1)
         string = string.strip()
         file_type = file_type.strip().lower()
     else:
-        string = query.query.strip()
+        string = text.strip()
         file_type = None
 
     offset = int(query.offset or 0)
-    reply_markup = get_reply_markup(query=string)
-    files, next_offset, total = await get_search_results(
+    variants = None
+    if group:
+        # Every upload of one release, largest first, on a single page
+        files = await get_group_variants(chat_id, string, group, file_type=file_type) if not offset else []
+        next_offset, total = '', len(files)
+        uploads = [1] * len(files)
+    elif GROUP_SEARCH_RESULTS:
+        # One result per release; its button lists the other uploads of it
+        groups, next_offset, total = await get_grouped_search_results(
                                                   chat_id,
                                                   string,
                                                   file_type=file_type,
                                                   max_results=10,
                                                   offset=offset)
+        files = [group['file'] for group in groups]
+        uploads = [group['count'] for group in groups]
+        variants = [
+            f"{text.strip()}{VARIANTS_MARK}{found['title_key']}{VARIANTS_MARK}{found['resolution'] or '-'}"
+            if found['count'] > 1 and found['title_key'] else None
+            for found in groups
+        ]
+    else:
+        files, next_offset, total = await get_search_results(
+                                                  chat_id,
+                                                  string,
+                                                  file_type=file_type,
+                                                  max_results=10,
+                                                  offset=offset)
+        uploads = [1] * len(files)
 
-    for file in files:
+    for file, count, variants_query in zip(files, uploads, variants or [None] * len(files)):
         title=file.file_name
         size=get_size(file.file_size)
         f_caption=file.caption
@@ -74,8 +103,8 @@ async def answer(bot, query):
                 title=file.file_name,
                 document_file_id=file.file_id,
                 caption=f_caption,
-                description=f'Size: {get_size(file.file_size)}\nType: {file.file_type}',
-                reply_markup=reply_markup))
+                description=f'Size: {get_size(file.file_size)}\nType: {file.file_type}' + (f' • {count} uploads' if count > 1 else ''),
+                reply_markup=get_reply_markup(query=string, variants_query=variants_query, uploads=count)))
 
     if results:
         switch_pm_text = f"{emoji.FILE_FOLDER} Results - {total}"
@@ -104,12 +133,15 @@ async def answer(bot, query):
                            switch_pm_parameter="okay")
 
 
-def get_reply_markup(query):
+def get_reply_markup(query, variants_query=None, uploads=1):
     buttons = [
         [
             InlineKeyboardButton('Search again', switch_inline_query_current_chat=query)
         ]
         ]
+    # Inline queries are capped at 256 characters
+    if variants_query and len(variants_query) <= 256:
+        buttons.append([InlineKeyboardButton(f'📂 All {uploads} uploads', switch_inline_query_current_chat=variants_query)])
     return InlineKeyboardMarkup(buttons)
 
 
@@ -7,9 +7,12 @@ import time
 import mimetypes
 from aiohttp.http_exceptions import BadStatusLine
 from lazybot import multi_clients, work_loads, LazyPrincessBot
+from lazybot.indexer import index_jobs
 from server.exceptions import FIleNotFound, InvalidHash
 from zzint import StartTime, __version__
 from util.custom_dl import ByteStreamer
+from util.chunk_cache import chunk_cache
+from util.load_balancer import balancer
 from util.time_format import get_readable_time
 from info import *
 
@@ -43,6 +46,28 @@ async def stream_handler(request: web.Request):
         logging.critical(e.with_traceback(None))
         raise web.HTTPInternalServerError(text=str(e))
 
+def check_status_token(request: web.Request):
+    token = request.rel_url.query.get("token", "")
+    if not INDEX_STATUS_TOKEN or not secrets.compare_digest(token.encode(), INDEX_STATUS_TOKEN.encode()):
+        raise web.HTTPForbidden(text="Invalid token")
+
+@routes.get("/index/jobs", allow_head=True)
+async def index_jobs_handler(request: web.Request):
+    check_status_token(request)
+    return web.json_response([job.to_dict() for job in index_jobs.jobs.values()])
+
+@routes.get(r"/index/jobs/{job_id:\d+}", allow_head=True)
+async def index_job_handler(request: web.Request):
+    check_status_token(request)
+    job = index_jobs.jobs.get(int(request.match_info["job_id"]))
+    if job is None:
+        raise web.HTTPNotFound(text="No such index job")
+    return web.json_response(job.to_dict())
+
+@routes.get("/stream/stats", allow_head=True)
+async def stream_stats_handler(request: web.Request):
+    return web.json_response({"chunk_cache": chunk_cache.stats(), "clients": balancer.stats()})
+
 @routes.get(r"/{path:\S+}", allow_head=True)
 async def stream_handler(request: web.Request):
     try:
@@ -67,10 +92,41 @@ async def stream_handler(request: web.Request):
 
 class_cache = {}
 
+def get_streamer(index: int) -> ByteStreamer:
+    client = multi_clients[index]
+    if client not in class_cache:
+        class_cache[client] = ByteStreamer(client)
+    return class_cache[client]
+
+def get_known_dc(id: int):
+    """The DC of message `id`'s file if any client resolved it already, else None."""
+    for streamer in class_cache.values():
+        if id in streamer.cached_file_ids:
+            return streamer.cached_file_ids[id].dc_id
+    return None
+
+async def get_stripes(index: int, id: int, dc_id: int):
+    """
+    Pick up to STREAM_STRIPE_CLIENTS - 1 of the best ranked other clients to
+    fetch chunks of the same download, each with its own FileId of the file.
+    """
+    stripes = []
+    for other in balancer.rank(dc_id):
+        if len(stripes) >= STREAM_STRIPE_CLIENTS - 1:
+            break
+        if other == index:
+            continue
+        streamer = get_streamer(other)
+        try:
+            stripes.append((streamer, other, await streamer.get_file_properties(id)))
+        except Exception as e:
+            logging.debug(f"Client {other} can't read message {id}, not striping over it: {e}")
+    return stripes
+
 async def media_streamer(request: web.Request, id: int, secure_hash: str):
     range_header = request.headers.get("Range", 0)
     
-    index = min(work_loads, key=work_loads.get)
+    index = balancer.pick(get_known_dc(id))
     faster_client = multi_clients[index]
     
     if MULTI_CLIENT:
@@ -117,8 +173,9 @@ async def media_streamer(request: web.Request, id: int, secure_hash: str):
 
     req_length = until_bytes - from_bytes + 1
     part_count = math.ceil(until_bytes / chunk_size) - math.floor(offset / chunk_size)
+    stripes = await get_stripes(index, id, file_id.dc_id) if part_count > 1 else []
     body = tg_connect.yield_file(
-        file_id, index, offset, first_part_cut, last_part_cut, part_count, chunk_size
+        file_id, index, offset, first_part_cut, last_part_cut, part_count, chunk_size, stripes
     )
 
     mime_type = file_id.mime_type
@@ -0,0 +1,60 @@
+from collections import OrderedDict
+from info import STREAM_CACHE_SIZE
+
+
+class ChunkCache:
+    """
+    LRU cache of file chunks downloaded by the streaming server, so the
+    overlapping range requests players send while seeking don't fetch the same
+    chunk from Telegram again.
+    attributes:
+        max_bytes: total size of the cached chunks before the oldest are evicted.
+        size: total size of the cached chunks.
+        hits / misses: lookups answered and not answered from the cache.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.chunks = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, media_id: int, offset: int):
+        """Return the cached chunk of `media_id` at `offset`, or None."""
+        chunk = self.chunks.get((media_id, offset))
+        if chunk is None:
+            self.misses += 1
+            return None
+        self.chunks.move_to_end((media_id, offset))
+        self.hits += 1
+        return chunk
+
+    def put(self, media_id: int, offset: int, chunk: bytes):
+        if not chunk or len(chunk) > self.max_bytes:
+            return
+        key = (media_id, offset)
+        if key in self.chunks:
+            self.size -= len(self.chunks.pop(key))
+        self.chunks[key] = chunk
+        self.size += len(chunk)
+        while self.size > self.max_bytes:
+            _, evicted = self.chunks.popitem(last=False)
+            self.size -= len(evicted)
+            self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'chunks': len(self.chunks),
+            'size': self.size,
+            'max_size': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0,
+        }
+
+
+chunk_cache = ChunkCache(STREAM_CACHE_SIZE * 1024 * 1024)
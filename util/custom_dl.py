@@ -2,13 +2,16 @@
 import math
 import asyncio
 import logging
+from collections import deque
 from info import *
-from typing import Dict, Union
+from typing import Dict, List, Tuple, Union
 from lazybot import work_loads
 from pyrogram import Client, utils, raw
 from .file_properties import get_file_ids
-from pyrogram.session import Session, Auth
-from pyrogram.errors import AuthBytesInvalid
+from .chunk_cache import chunk_cache
+from .load_balancer import balancer
+from .media_sessions import media_sessions
+from pyrogram.session import Session
 from server.exceptions import FIleNotFound
 from pyrogram.file_id import FileId, FileType, ThumbnailSource
 
@@ -61,59 +64,11 @@ class ByteStreamer:
 
     async def generate_media_session(self, client: Client, file_id: FileId) -> Session:
         """
-        Generates the media session for the DC that contains the media file.
+        Returns a media session for the DC that contains the media file.
         This is required for getting the bytes from Telegram servers.
+        Sessions come from the shared pool, which pre-warms and health-checks them.
         """
-
-        media_session = client.media_sessions.get(file_id.dc_id, None)
-
-        if media_session is None:
-            if file_id.dc_id != await client.storage.dc_id():
-                media_session = Session(
-                    client,
-                    file_id.dc_id,
-                    await Auth(
-                        client, file_id.dc_id, await client.storage.test_mode()
-                    ).create(),
-                    await client.storage.test_mode(),
-                    is_media=True,
-                )
-                await media_session.start()
-
-                for _ in range(6):
-                    exported_auth = await client.invoke(
-                        raw.functions.auth.ExportAuthorization(dc_id=file_id.dc_id)
-                    )
-
-                    try:
-                        await media_session.send(
-                            raw.functions.auth.ImportAuthorization(
-                                id=exported_auth.id, bytes=exported_auth.bytes
-                            )
-                        )
-                        break
-                    except AuthBytesInvalid:
-                        logging.debug(
-                            f"Invalid authorization bytes for DC {file_id.dc_id}"
-                        )
-                        continue
-                else:
-                    await media_session.stop()
-                    raise AuthBytesInvalid
-            else:
-                media_session = Session(
-                    client,
-                    file_id.dc_id,
-                    await client.storage.auth_key(),
-                    await client.storage.test_mode(),
-                    is_media=True,
-                )
-                await media_session.start()
-            logging.debug(f"Created media session for DC {file_id.dc_id}")
-            client.media_sessions[file_id.dc_id] = media_session
-        else:
-            logging.debug(f"Using cached media session for DC {file_id.dc_id}")
-        return media_session
+        return await media_sessions.get(client, file_id.dc_id)
 
 
     @staticmethod
@@ -161,6 +116,25 @@ class ByteStreamer:
             )
         return location
 
+    @staticmethod
+    async def get_chunk(media_session: Session, location, media_id: int, offset: int, chunk_size: int) -> Union[bytes, None]:
+        """
+        Returns the `chunk_size` bytes of the media file at `offset`, from the
+        chunk cache if an earlier request fetched them already.
+        """
+        chunk = chunk_cache.get(media_id, offset)
+        if chunk is not None:
+            return chunk
+        r = await media_session.send(
+            raw.functions.upload.GetFile(
+                location=location, offset=offset, limit=chunk_size
+            ),
+        )
+        if not isinstance(r, raw.types.upload.File):
+            return None
+        chunk_cache.put(media_id, offset, r.bytes)
+        return r.bytes
+
     async def yield_file(
         self,
         file_id: FileId,
@@ -170,56 +144,72 @@ class ByteStreamer:
         last_part_cut: int,
         part_count: int,
         chunk_size: int,
+        stripes: List[Tuple["ByteStreamer", int, FileId]] = (),
     ) -> Union[str, None]:
         """
         Custom generator that yields the bytes of the media file.
+        `stripes` are (ByteStreamer, client index, FileId) of other clients that
+        can read the file; consecutive chunks are then fetched round-robin by
+        this client and those, in parallel, and still yielded in order.
         Modded from <https://github.com/eyaadh/megadlbot_oss/blob/master/mega/telegram/utils/custom_download.py#L20>
         Thanks to Eyaadh <https://github.com/eyaadh>
         """
         client = self.client
-        work_loads[index] += 1
         logging.debug(f"Starting to yielding file with client {index}.")
         media_session = await self.generate_media_session(client, file_id)
+        location = await self.get_location(file_id)
+        # (client index, media session, location) of every client fetching chunks
+        sources = [(index, media_session, location)]
+        for streamer, stripe_index, stripe_file_id in stripes:
+            try:
+                stripe_session = await streamer.generate_media_session(streamer.client, stripe_file_id)
+            except Exception as e:
+                logging.warning(f"Client {stripe_index} can't join the download: {e}")
+                continue
+            sources.append((stripe_index, stripe_session, await self.get_location(stripe_file_id)))
+        for source_index, _, _ in sources:
+            work_loads[source_index] += 1
 
         current_part = 1
-        location = await self.get_location(file_id)
+        # Up to STREAM_READ_AHEAD GetFile requests per client in flight, consumed in order
+        pending = deque()
+        requested = 0
 
         try:
-            r = await media_session.send(
-                raw.functions.upload.GetFile(
-                    location=location, offset=offset, limit=chunk_size
-                ),
-            )
-            if isinstance(r, raw.types.upload.File):
-                while True:
-                    chunk = r.bytes
-                    if not chunk:
-                        break
-                    elif part_count == 1:
-                        yield chunk[first_part_cut:last_part_cut]
-                    elif current_part == 1:
-                        yield chunk[first_part_cut:]
-                    elif current_part == part_count:
-                        yield chunk[:last_part_cut]
-                    else:
-                        yield chunk
-
-                    current_part += 1
-                    offset += chunk_size
-
-                    if current_part > part_count:
-                        break
-
-                    r = await media_session.send(
-                        raw.functions.upload.GetFile(
-                            location=location, offset=offset, limit=chunk_size
-                        ),
+            while current_part <= part_count:
+                while requested < part_count and len(pending) < max(1, STREAM_READ_AHEAD) * len(sources):
+                    source_index, source_session, source_location = sources[requested % len(sources)]
+                    task = asyncio.create_task(
+                        self.get_chunk(source_session, source_location, file_id.media_id, offset + requested * chunk_size, chunk_size)
+                    )
+                    balancer.request_started(source_index, chunk_size)
+                    # Also retrieves the errors of chunks dropped when the client goes away
+                    task.add_done_callback(
+                        lambda t, i=source_index: balancer.request_finished(i, chunk_size, None if t.cancelled() else t.exception())
                     )
+                    pending.append(task)
+                    requested += 1
+                chunk = await pending.popleft()
+                if not chunk:
+                    break
+                elif part_count == 1:
+                    yield chunk[first_part_cut:last_part_cut]
+                elif current_part == 1:
+                    yield chunk[first_part_cut:]
+                elif current_part == part_count:
+                    yield chunk[:last_part_cut]
+                else:
+                    yield chunk
+
+                current_part += 1
         except (TimeoutError, AttributeError):
             pass
         finally:
+            for task in pending:
+                task.cancel()
             logging.debug("Finished yielding file with {current_part} parts.")
-            work_loads[index] -= 1
+            for source_index, _, _ in sources:
+                work_loads[source_index] -= 1
 
     
     async def clean_cache(self) -> None:
@@ -0,0 +1,95 @@
+import time
+import logging
+from typing import Dict, List, Optional
+from pyrogram.errors import FloodWait
+from lazybot import multi_clients, work_loads
+from info import STREAM_BALANCER
+
+# Error rate weight of the newest request outcome (exponential moving average)
+ERROR_DECAY = 0.1
+# Seconds a client sits out after a failed request that wasn't a FloodWait
+ERROR_COOLDOWN = 5
+
+
+def least_loaded_score(balancer: "LoadBalancer", index: int, dc_id: Optional[int]) -> float:
+    """The original policy: fewest active streams wins."""
+    return work_loads.get(index, 0)
+
+
+def weighted_score(balancer: "LoadBalancer", index: int, dc_id: Optional[int]) -> float:
+    """
+    Active streams, plus in-flight MB, plus a penalty growing with the recent
+    error rate, minus a bonus when the client already has a session for `dc_id`
+    (opening one costs an auth export/import round trip).
+    """
+    score = work_loads.get(index, 0) + balancer.inflight.get(index, 0) / (1024 * 1024)
+    score += 10 * balancer.error_rate.get(index, 0)
+    client = multi_clients.get(index)
+    if dc_id is not None and client is not None and dc_id in client.media_sessions:
+        score -= 1
+    return score
+
+
+# STREAM_BALANCER name -> score function; lower scores are picked first
+SCORERS = {
+    'weighted': weighted_score,
+    'least_loaded': least_loaded_score,
+}
+
+
+class LoadBalancer:
+    """
+    Chooses the clients that serve streaming requests.
+    attributes:
+        score: function(balancer, index, dc_id) ranking a client, lowest first.
+        inflight: bytes requested from Telegram and not received yet, per client.
+        error_rate: moving average of failed requests, per client.
+        cooldown: monotonic time until which a client is skipped, per client.
+    """
+
+    def __init__(self, score=weighted_score):
+        self.score = score
+        self.inflight: Dict[int, int] = {}
+        self.error_rate: Dict[int, float] = {}
+        self.cooldown: Dict[int, float] = {}
+
+    def rank(self, dc_id: Optional[int] = None) -> List[int]:
+        """All client indexes, best first. Clients in cooldown come last."""
+        now = time.monotonic()
+        return sorted(
+            work_loads,
+            key=lambda index: (self.cooldown.get(index, 0) > now, self.score(self, index, dc_id))
+        )
+
+    def pick(self, dc_id: Optional[int] = None) -> int:
+        return self.rank(dc_id)[0]
+
+    def request_started(self, index: int, size: int):
+        self.inflight[index] = self.inflight.get(index, 0) + size
+
+    def request_finished(self, index: int, size: int, error: Optional[BaseException] = None):
+        """Record the outcome of a request started with request_started."""
+        self.inflight[index] = max(0, self.inflight.get(index, 0) - size)
+        rate = self.error_rate.get(index, 0) * (1 - ERROR_DECAY)
+        if isinstance(error, FloodWait):
+            self.cooldown[index] = time.monotonic() + error.value
+            logging.warning(f"Client {index} got a FloodWait of {error.value}s, cooling it down")
+        elif error is not None:
+            rate += ERROR_DECAY
+            self.cooldown[index] = time.monotonic() + ERROR_COOLDOWN
+        self.error_rate[index] = rate
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            index: {
+                'streams': work_loads.get(index, 0),
+                'inflight': self.inflight.get(index, 0),
+                'error_rate': round(self.error_rate.get(index, 0), 3),
+                'cooldown': round(max(0, self.cooldown.get(index, 0) - now), 1),
+            }
+            for index in work_loads
+        }
+
+
+balancer = LoadBalancer(SCORERS.get(STREAM_BALANCER, weighted_score))
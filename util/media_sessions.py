@@ -0,0 +1,162 @@
+import random
+import asyncio
+import logging
+from typing import Dict, List, Tuple
+from pyrogram import Client, raw
+from pyrogram.session import Session, Auth
+from pyrogram.errors import AuthBytesInvalid
+from info import MEDIA_SESSION_POOL, MEDIA_SESSION_PING
+
+# Production DCs sessions are pre-warmed for
+DC_IDS = [1, 2, 3, 4, 5]
+# Seconds a health ping may take before its session is recreated
+PING_TIMEOUT = 10
+
+
+class MediaSessionManager:
+    """
+    Keeps MEDIA_SESSION_POOL media sessions per (client, DC), so that streams
+    spread over several connections and the first viewer of a DC doesn't wait
+    for the authorization export/import.
+    attributes:
+        pools: list of started sessions per (client, DC).
+    functions:
+        get: returns a session of the pool for the DC, creating the pool if needed.
+        prewarm: creates the pools of every DC for the given clients.
+        health_check: pings every session periodically and recreates the dead ones.
+    """
+
+    def __init__(self, pool_size: int = MEDIA_SESSION_POOL):
+        self.pool_size = max(1, pool_size)
+        self.pools: Dict[Tuple[Client, int], List[Session]] = {}
+        self.locks: Dict[Tuple[Client, int], asyncio.Lock] = {}
+
+    async def get(self, client: Client, dc_id: int) -> Session:
+        pool = self.pools.get((client, dc_id))
+        if not pool:
+            pool = await self.create_pool(client, dc_id)
+        return random.choice(pool)
+
+    async def create_pool(self, client: Client, dc_id: int) -> List[Session]:
+        key = (client, dc_id)
+        lock = self.locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            if self.pools.get(key):
+                return self.pools[key]
+            auth_key = await self.get_auth_key(client, dc_id)
+            pool = [await self.create_session(client, dc_id, auth_key, authorize=i == 0) for i in range(self.pool_size)]
+            self.pools[key] = pool
+            # Lets Pyrogram's own downloads use the pool as well
+            client.media_sessions[dc_id] = pool[0]
+            logging.debug(f"Created {len(pool)} media sessions for DC {dc_id}")
+            return pool
+
+    @staticmethod
+    async def get_auth_key(client: Client, dc_id: int) -> bytes:
+        if dc_id == await client.storage.dc_id():
+            return await client.storage.auth_key()
+        return await Auth(client, dc_id, await client.storage.test_mode()).create()
+
+    @staticmethod
+    async def create_session(client: Client, dc_id: int, auth_key: bytes, authorize: bool = True) -> Session:
+        """
+        Start a media session on `dc_id`. On a foreign DC the authorization is
+        exported from the client's home DC and imported, which only has to be
+        done once per auth key.
+        """
+        media_session = Session(
+            client,
+            dc_id,
+            auth_key,
+            await client.storage.test_mode(),
+            is_media=True,
+        )
+        await media_session.start()
+        if not authorize or dc_id == await client.storage.dc_id():
+            return media_session
+
+        for _ in range(6):
+            exported_auth = await client.invoke(
+                raw.functions.auth.ExportAuthorization(dc_id=dc_id)
+            )
+
+            try:
+                await media_session.send(
+                    raw.functions.auth.ImportAuthorization(
+                        id=exported_auth.id, bytes=exported_auth.bytes
+                    )
+                )
+                return media_session
+            except AuthBytesInvalid:
+                logging.debug(
+                    f"Invalid authorization bytes for DC {dc_id}"
+                )
+                continue
+        await media_session.stop()
+        raise AuthBytesInvalid
+
+    async def prewarm(self, clients: List[Client]):
+        """Create the pools of every DC for `clients`, so no stream waits for one."""
+        for client in clients:
+            for dc_id in DC_IDS:
+                try:
+                    await self.create_pool(client, dc_id)
+                except Exception as e:
+                    logging.warning(f"Could not pre-warm media sessions of {client.name} for DC {dc_id}: {e}")
+        logging.info(f"Pre-warmed {sum(len(pool) for pool in self.pools.values())} media sessions")
+
+    async def health_check(self):
+        """Every MEDIA_SESSION_PING seconds, ping every session and replace those that don't answer."""
+        while True:
+            await asyncio.sleep(MEDIA_SESSION_PING)
+            for (client, dc_id), pool in list(self.pools.items()):
+                for media_session in list(pool):
+                    try:
+                        await self.check(client, dc_id, media_session)
+                    except Exception as e:
+                        logging.error(f"Health check of a media session of {client.name} for DC {dc_id} failed: {e}")
+
+    async def check(self, client: Client, dc_id: int, media_session: Session):
+        if media_session not in self.pools.get((client, dc_id), []):
+            # Already replaced while earlier sessions were checked
+            return
+        try:
+            await media_session.send(raw.functions.Ping(ping_id=random.getrandbits(63)), timeout=PING_TIMEOUT)
+        except Exception as e:
+            logging.warning(f"Media session of {client.name} for DC {dc_id} is unhealthy, recreating it: {e}")
+            await self.recreate(client, dc_id, media_session)
+
+    async def recreate(self, client: Client, dc_id: int, old: Session):
+        """Replace `old` in its pool with a new session, or drop it if that fails."""
+        pool = self.pools.get((client, dc_id))
+        if not pool or old not in pool:
+            # Replaced or dropped while it was being pinged
+            return
+        try:
+            await old.stop()
+        except Exception:
+            pass
+        try:
+            # A new session on the same auth key needs no new authorization
+            new = await self.create_session(client, dc_id, old.auth_key, authorize=False)
+        except Exception as e:
+            logging.error(f"Could not recreate media session of {client.name} for DC {dc_id}: {e}")
+            new = None
+        # The pool may have changed while the session was being created
+        if self.pools.get((client, dc_id)) is not pool or old not in pool:
+            if new is not None:
+                await new.stop()
+            return
+        if new is not None:
+            pool[pool.index(old)] = new
+        else:
+            pool.remove(old)
+        if not pool:
+            # The next stream for this DC builds the pool again from scratch
+            del self.pools[(client, dc_id)]
+            client.media_sessions.pop(dc_id, None)
+        elif client.media_sessions.get(dc_id) is old:
+            client.media_sessions[dc_id] = pool[0]
+
+
+media_sessions = MediaSessionManager()